@@ -7,6 +7,7 @@ import random
 import requests
 from api.utils.relval_test_submitter import RelvalTestSubmitter
 from database.database import Database
+from database.query_language import Query
 from core_lib.controller.controller_base import ControllerBase
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.global_config import Config
@@ -20,6 +21,7 @@ from core_lib.utils.common_utils import (clean_split,
 from resources.smart_tricks import check_if_dataset_exists
 from ..utils.submitter import RequestSubmitter
 from ..utils.dqm_submitter import DQMRequestSubmitter
+from ..utils.objects_summary import ObjectsSummary
 from ..model.ticket import Ticket
 from ..model.relval import RelVal
 from ..model.relval_step import RelValStep
@@ -40,6 +42,41 @@ class RelValController(ControllerBase):
         self.model_class = RelVal
 
     def create(self, json_data, condition_name=''):
+        prepid_part = self.get_prepid_part(json_data, condition_name)
+        # Get a new serial number
+        serial_number = self.reserve_serial_numbers(prepid_part)
+        json_data['prepid'] = f'{prepid_part}-{serial_number:05d}'
+        relval = super().create(json_data)
+        return relval
+
+    def create_many(self, json_list, condition_names=None):
+        """
+        Create several RelVals with a single write, all or nothing
+        Condition names are given for each RelVal, serial numbers are reserved
+        once for all RelVals with the same prepid prefix
+        """
+        condition_names = condition_names or [''] * len(json_list)
+        prepid_parts = [self.get_prepid_part(json_data, condition_name)
+                        for json_data, condition_name in zip(json_list, condition_names)]
+        serial_numbers = {}
+        for prepid_part in prepid_parts:
+            serial_numbers[prepid_part] = serial_numbers.get(prepid_part, 0) + 1
+
+        for prepid_part, count in serial_numbers.items():
+            serial_numbers[prepid_part] = self.reserve_serial_numbers(prepid_part, count)
+
+        for json_data, prepid_part in zip(json_list, prepid_parts):
+            serial_number = serial_numbers[prepid_part]
+            serial_numbers[prepid_part] += 1
+            json_data['prepid'] = f'{prepid_part}-{serial_number:05d}'
+
+        return super().create_many(json_list)
+
+    def get_prepid_part(self, json_data, condition_name=''):
+        """
+        Return prepid of a new RelVal without serial number
+        Workflow name is set from the first step if it is not given
+        """
         cmssw_release = json_data.get('cmssw_release')
         batch_name = json_data.get('batch_name')
         # Use workflow name for prepid if possible, if not - first step name
@@ -51,36 +88,35 @@ class RelValController(ControllerBase):
             json_data['workflow_name'] = workflow_name
 
         condition_name = f'{condition_name}-' if condition_name else ''
-        prepid_part = f'{cmssw_release}__{batch_name}-{condition_name}{workflow_name}'.strip('-_')
-        json_data['prepid'] = f'{prepid_part}-00000'
-        relval_db = Database('relvals')
-        with self.locker.get_lock(f'generate-relval-prepid-{prepid_part}'):
-            # Get a new serial number
-            serial_number = self.get_highest_serial_number(relval_db,
-                                                           f'{prepid_part}-*')
-            serial_number += 1
-            # Form a new temporary prepid
-            prepid = f'{prepid_part}-{serial_number:05d}'
-            json_data['prepid'] = prepid
-            relval = super().create(json_data)
+        return f'{cmssw_release}__{batch_name}-{condition_name}{workflow_name}'.strip('-_')
 
-        return relval
+    def after_create(self, obj):
+        ObjectsSummary().apply_change(self.database_name, None, obj.get_json_view())
+
+    def after_transition(self, obj, old_status):
+        ObjectsSummary().apply_status_change(self.database_name, obj.get_json_view(), old_status)
 
     def after_update(self, old_obj, new_obj, changed_values):
         self.logger.info('Changed values: %s', changed_values)
+        ObjectsSummary().apply_change(self.database_name,
+                                      old_obj.get_json_view(),
+                                      new_obj.get_json_view())
         if 'workflow_name' in changed_values:
             new_relval = self.create(new_obj.get_json())
             old_prepid = old_obj.get_prepid()
             new_prepid = new_relval.get_prepid()
             new_relval.set('history', old_obj.get('history'))
+            new_relval.set('created_on', old_obj.get('created_on'))
+            new_relval.set('created_by', old_obj.get('created_by'))
             new_relval.add_history('rename', [old_prepid, new_prepid], None)
             relvals_db = Database('relvals')
             relvals_db.save(new_relval.get_json())
+            relvals_db.copy_history(old_prepid, new_prepid)
             self.logger.info('Created %s as rename of %s', new_prepid, old_prepid)
             new_obj.set('prepid', new_prepid)
             # Update the ticket...
             tickets_db = Database('tickets')
-            tickets = tickets_db.query(f'created_relvals={old_obj.get_prepid()}')
+            tickets = tickets_db.query(Query().equals('created_relvals', old_obj.get_prepid()))
             self.logger.debug(json.dumps(tickets, indent=2))
             for ticket_json in tickets:
                 ticket_prepid = ticket_json['prepid']
@@ -98,6 +134,13 @@ class RelValController(ControllerBase):
 
             self.delete(old_obj.get_json())
 
+    def get_archive_query(self, changed_before):
+        """
+        Deleted RelVals as well as done and archived RelVals can be archived
+        """
+        return {'$or': [{'deleted': True}, {'status': {'$in': ['done', 'archived']}}],
+                'last_update': {'$lt': changed_before}}
+
     def get_editing_info(self, obj):
         editing_info = super().get_editing_info(obj)
         prepid = obj.get_prepid()
@@ -129,9 +172,10 @@ class RelValController(ControllerBase):
         return editing_info
 
     def after_delete(self, obj):
+        ObjectsSummary().apply_change(self.database_name, obj.get_json_view(), None)
         prepid = obj.get_prepid()
         tickets_db = Database('tickets')
-        tickets = tickets_db.query(f'created_relvals={prepid}')
+        tickets = tickets_db.query(Query().equals('created_relvals', prepid))
         self.logger.debug(json.dumps(tickets, indent=2))
         for ticket_json in tickets:
             ticket_prepid = ticket_json['prepid']
@@ -504,15 +548,12 @@ class RelValController(ControllerBase):
         step = RelValStep.schema()
         return step
 
-    def update_status(self, relval, status, timestamp=None):
+    def update_status(self, relval, status, timestamp=None, attributes=()):
         """
-        Set new status to RelVal, update history accordingly and save to database
+        Set new status to RelVal, update history accordingly and save status and
+        given changed attributes to database
         """
-        relval_db = Database(self.database_name)
-        relval.set('status', status)
-        relval.add_history('status', status, None, timestamp)
-        relval_db.save(relval.get_json())
-        self.logger.info('Set "%s" status to "%s"', relval.get_prepid(), status)
+        self.transition(relval, status, attributes, timestamp=timestamp)
 
     def next_status(self, relvals):
         """
@@ -568,7 +609,7 @@ class RelValController(ControllerBase):
             elif relval.get('status') == 'submitted':
                 self.move_relval_back_to_approved(relval)
             elif relval.get('status') in ('done', 'archived'):
-                self.move_relval_back_to_approved(relval)
+                relval = self.move_relval_back_to_approved(relval)
                 self.move_relval_back_to_new(relval)
 
         return relval
@@ -604,7 +645,7 @@ class RelValController(ControllerBase):
     def get_optimal_parameters(self, relval):
         """Do local testing and fetch optimal parameters for submission"""
         tickets_db = Database('tickets')
-        tickets = tickets_db.query(f'created_relvals={relval.get_prepid()}')
+        tickets = tickets_db.query(Query().equals('created_relvals', relval.get_prepid()))
         ticket_note = tickets[0].get('notes') if tickets else ''
         relval_note = relval.get('notes')
         ticket_note = ticket_note.strip().startswith('Skip local test')
@@ -666,9 +707,9 @@ class RelValController(ControllerBase):
                 # Perform local test and fetch optimal params for submission
                 test_skipped = self.get_optimal_parameters(relval)
                 if test_skipped:
-                    self.update_status(relval, 'approved')
+                    self.update_status(relval, 'approved', attributes=('steps', ))
                 else:
-                    self.update_status(relval, 'approving')
+                    self.update_status(relval, 'approving', attributes=('steps', ))
                 results.append(relval)
 
         return results
@@ -744,7 +785,8 @@ class RelValController(ControllerBase):
                 with self.locker.get_lock(locker_key):
                     now = int(time.time())
                     # Get RelVal with newest timestamp in this campaign (CMSSW + Batch Name)
-                    db_query = f'cmssw_release={cmssw_release}&&batch_name={batch_name}'
+                    db_query = Query().equals('cmssw_release', cmssw_release)
+                    db_query.equals('batch_name', batch_name)
                     relvals_with_timestamp = relval_db.query(db_query,
                                                              limit=1,
                                                              sort_attr='campaign_timestamp',
@@ -767,7 +809,7 @@ class RelValController(ControllerBase):
                                      batch_name,
                                      newest_timestamp)
                     relval.set('campaign_timestamp', newest_timestamp)
-                    self.update_status(relval, 'submitting')
+                    self.update_status(relval, 'submitting', attributes=('campaign_timestamp', ))
 
                 RequestSubmitter().add(relval, self)
                 results.append(relval)
@@ -848,7 +890,7 @@ class RelValController(ControllerBase):
         for step in relval.get('steps'):
             step.set('resolved_globaltag', '')
 
-        self.update_status(relval, 'new')
+        self.update_status(relval, 'new', attributes=('steps', ))
         return relval
 
     def move_relval_back_to_approved(self, relval):
@@ -871,7 +913,9 @@ class RelValController(ControllerBase):
 
         relval.set('campaign_timestamp', 0)
         relval.set('output_datasets', [])
-        self.update_status(relval, 'approved')
+        self.update_status(relval,
+                           'approved',
+                           attributes=('steps', 'campaign_timestamp', 'output_datasets'))
         return relval
 
     def pick_workflows(self, all_workflows, output_datasets):
@@ -6,6 +6,7 @@ import os
 import time, datetime
 from copy import deepcopy
 from database.database import Database
+from database.query_language import Query
 from core_lib.controller.controller_base import ControllerBase
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.common_utils import (clean_split,
@@ -17,6 +18,7 @@ from ..model.ticket import Ticket
 from ..model.relval import RelVal
 from ..model.relval_step import RelValStep
 from ..controller.relval_controller import RelValController
+from ..utils.objects_summary import ObjectsSummary
 from core_lib.utils.emailer import Emailer
 
 class TicketController(ControllerBase):
@@ -34,24 +36,17 @@ class TicketController(ControllerBase):
         cmssw_release = json_data.get('cmssw_release')
         batch_name = json_data.get('batch_name')
         prepid_part = f'{cmssw_release}__{batch_name}'
-        ticket_db = Database('tickets')
-        json_data['prepid'] = f'{prepid_part}-00000'
-        with self.locker.get_lock(f'generate-ticket-prepid-{prepid_part}'):
-            # Get a new serial number
-            serial_number = self.get_highest_serial_number(ticket_db,
-                                                           f'{prepid_part}-*')
-            serial_number += 1
-            # Form a new temporary prepid
-            prepid = f'{prepid_part}-{serial_number:05d}'
-            json_data['prepid'] = prepid
-            ticket = super().create(json_data)
-
+        # Get a new serial number
+        serial_number = self.reserve_serial_numbers(prepid_part)
+        json_data['prepid'] = f'{prepid_part}-{serial_number:05d}'
+        ticket = super().create(json_data)
         return ticket
 
     def after_create(self, obj):
         """
         Actions to be performed after object is created
         """
+        ObjectsSummary().apply_change(self.database_name, None, obj.get_json_view())
         prepid = obj.get_prepid()
         service_url = Config.get('service_url')
         ticket_link = f'<a href="{service_url}/tickets?prepid={prepid}">{prepid}</a>'
@@ -65,6 +60,12 @@ class TicketController(ControllerBase):
         body += f'\nRegards,\nAlCaDB Team'
         emailer.send_with_mime(subject, body, recipients)
 
+    def after_delete(self, obj):
+        ObjectsSummary().apply_change(self.database_name, obj.get_json_view(), None)
+
+    def after_transition(self, obj, old_status):
+        ObjectsSummary().apply_status_change(self.database_name, obj.get_json_view(), old_status)
+
     def get_editing_info(self, obj):
         editing_info = super().get_editing_info(obj)
         prepid = obj.get_prepid()
@@ -517,7 +518,6 @@ class TicketController(ControllerBase):
         """
         Create RelVals from given ticket. Return list of relval prepids
         """
-        ticket_db = Database('tickets')
         ticket_prepid = ticket.get_prepid()
         ssh_executor = SSHExecutor('lxplus.cern.ch', Config.get('credentials_file'))
         relval_controller = RelValController()
@@ -543,21 +543,28 @@ class TicketController(ControllerBase):
                                            relval_controller,
                                            recycle_input_of)
 
-                for relval, relval_tag in zip(relvals, relval_tags):
-                    relval = relval_controller.create(relval.get_json(), condition_name=relval_tag[0])
-                    created_relvals.append(relval)
-                    self.logger.info('Created %s', relval.get_prepid())
-
+                created_relvals = relval_controller.create_many([r.get_json() for r in relvals],
+                                                                [t[0] for t in relval_tags])
+                self.logger.info('Created %s',
+                                 ', '.join(r.get_prepid() for r in created_relvals))
                 created_relval_prepids = [r.get('prepid') for r in created_relvals]
                 ticket.set('created_relvals', created_relval_prepids)
-                ticket.set('status', 'done')
-                ticket.add_history('created_relvals', created_relval_prepids, None)
-                ticket_db.save(ticket.get_json())
+                self.transition(ticket,
+                                'done',
+                                ('created_relvals', ),
+                                'created_relvals',
+                                created_relval_prepids)
             except Exception as ex:
                 self.logger.error('Error creating RelVal from ticket: %s', ex)
-                # Delete created relvals if there was an Exception
-                for created_relval in reversed(created_relvals):
-                    relval_controller.delete({'prepid': created_relval.get('prepid')})
+                # Remove created relvals if there was an Exception
+                relvals_db = Database(relval_controller.database_name)
+                relvals_db.purge_many([r.get_prepid() for r in created_relvals])
+                # Created relvals were already counted in the summary
+                objects_summary = ObjectsSummary()
+                for relval in created_relvals:
+                    objects_summary.apply_change(relval_controller.database_name,
+                                                 relval.get_json_view(),
+                                                 None)
 
                 # And reraise the exception
                 raise ex
@@ -573,8 +580,7 @@ class TicketController(ControllerBase):
         """
         relvals_db = Database('relvals')
         created_relvals = ticket.get('created_relvals')
-        created_relvals_prepids = ','.join(created_relvals)
-        query = f'prepid={created_relvals_prepids}'
+        query = Query().any_of('prepid', created_relvals)
         results, _ = relvals_db.query_with_total_rows(query, limit=len(created_relvals))
         workflows = []
         for relval in results:
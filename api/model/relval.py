@@ -1,7 +1,7 @@
 """
 Module that contains RelVal class
 """
-from copy import deepcopy
+import weakref
 from ..model.model_base import ModelBase
 from ..model.relval_step import RelValStep
 from core_lib.utils.common_utils import clean_split, cmssw_setup, run_commands_in_cmsenv
@@ -27,6 +27,10 @@ class RelVal(ModelBase):
         'jira_ticket': '',
         # CPU cores
         'cpu_cores': 1,
+        # Username of creator
+        'created_by': '',
+        # Time of creation
+        'created_on': 0,
         # Custom fragment for the first step
         'fragment': '',
         # Action history
@@ -57,6 +61,8 @@ class RelVal(ModelBase):
         'steps': [],
         # Time per event in seconds
         'time_per_event': 20.0,
+        # Time of last update
+        'updated_on': 0,
         # Workflow ID
         'workflow_id': 0.0,
         # Workflows name
@@ -89,23 +95,72 @@ class RelVal(ModelBase):
     }
 
     def __init__(self, json_input=None, check_attributes=True):
+        # Incremented whenever steps change, invalidates memoized values of steps
+        self.steps_generation = 0
+        lazy_steps = False
         if json_input:
-            json_input = deepcopy(json_input)
-            step_objects = []
-            for step_index, step_json in enumerate(json_input.get('steps', [])):
-                step = RelValStep(json_input=step_json,
-                                  parent=self,
-                                  check_attributes=check_attributes)
-                step_objects.append(step)
-                if step_index > 0 and step.get_step_type() == 'input_file':
-                    raise Exception('Only first step can be input file')
-
-            json_input['steps'] = step_objects
+            # Unchecked input is only read, steps are replaced in a shallow copy
+            json_input = ModelBase.copy_json(json_input) if check_attributes else dict(json_input)
+            if check_attributes or not json_input.get('steps'):
+                json_input['steps'] = self.make_steps(json_input.get('steps', []),
+                                                      check_attributes)
+            else:
+                # Steps of unchecked RelVals are made on first get('steps')
+                lazy_steps = True
 
             if not isinstance(json_input['workflow_id'], (float, int)):
                 json_input['workflow_id'] = float(json_input['workflow_id'])
 
         ModelBase.__init__(self, json_input, check_attributes)
+        if lazy_steps:
+            self.set_lazy('steps')
+
+    def make_steps(self, steps_json, check_attributes):
+        """
+        Return list of RelValStep objects made of steps JSON
+        """
+        step_objects = []
+        for step_index, step_json in enumerate(steps_json):
+            step = RelValStep(json_input=step_json,
+                              parent=self,
+                              check_attributes=check_attributes)
+            step.index_in_parent = step_index
+            step_objects.append(step)
+            if step_index > 0 and step.get_step_type() == 'input_file':
+                raise Exception('Only first step can be input file')
+
+        self.steps_changed()
+        return step_objects
+
+    def hydrate(self, attribute, value):
+        if attribute == 'steps':
+            return self.make_steps(value, False)
+
+        return value
+
+    def set(self, attribute, value=None):
+        result = ModelBase.set(self, attribute, value)
+        if attribute.strip('.').split('.')[0] == 'steps':
+            self.index_steps()
+
+        return result
+
+    def index_steps(self):
+        """
+        Make this RelVal a parent of its steps and update their indices
+        """
+        for index, step in enumerate(self.get('steps')):
+            if isinstance(step, RelValStep):
+                step.parent = weakref.ref(self)
+                step.index_in_parent = index
+
+        self.steps_changed()
+
+    def steps_changed(self):
+        """
+        Drop memoized values of steps, e.g. input step index
+        """
+        self.steps_generation += 1
 
     def get_cmsdrivers(self, for_submission=False, for_test=False):
         """
@@ -179,7 +234,7 @@ class RelVal(ModelBase):
         step_command = '\n'.join(step_command)
         step_index = step.get_index_in_parent()
 
-        menu = self.get_json().get('hlt_menu')
+        menu = self.get('hlt_menu')
         menu = menu if menu else '/dev/CMSSW_12_4_0/GRun'
         # ----------------------------------------------------------------
 
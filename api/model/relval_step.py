@@ -3,7 +3,6 @@ Module that contains RelValStep class
 """
 import weakref
 import json
-from copy import deepcopy
 
 from resources.smart_tricks import check_if_dataset_exists
 from ..model.model_base import ModelBase
@@ -108,26 +107,27 @@ class RelValStep(ModelBase):
 
     def __init__(self, json_input=None, parent=None, check_attributes=True):
         if json_input:
-            json_input = deepcopy(json_input)
-            # Remove -- from argument names
-            schema = self.schema()
+            # Unchecked input is only read, changed parts are replaced in a shallow copy
+            json_input = ModelBase.copy_json(json_input) if check_attributes else dict(json_input)
             if json_input.get('input', {}).get('dataset'):
-                json_input['driver'] = schema.get('driver')
-                json_input['gpu'] = schema.get('gpu')
+                json_input['driver'] = self.get_default('driver')
+                json_input['gpu'] = self.get_default('gpu')
                 json_input['gpu']['requires'] = 'forbidden'
-                step_input = json_input['input']
-                for key, default_value in schema['input'].items():
+                step_input = dict(json_input['input'])
+                json_input['input'] = step_input
+                for key, default_value in self.get_default('input').items():
                     if key not in step_input:
                         step_input[key] = default_value
             else:
+                # Remove -- from argument names
                 json_input['driver'] = {k.lstrip('-'): v for k, v in json_input['driver'].items()}
-                json_input['input'] = schema.get('input')
+                json_input['input'] = self.get_default('input')
                 if json_input.get('gpu', {}).get('requires') not in ('optional', 'required'):
-                    json_input['gpu'] = schema.get('gpu')
+                    json_input['gpu'] = self.get_default('gpu')
                     json_input['gpu']['requires'] = 'forbidden'
 
                 driver = json_input['driver']
-                for key, default_value in schema['driver'].items():
+                for key, default_value in self.get_default('driver').items():
                     if key not in driver:
                         driver[key] = default_value
 
@@ -137,12 +137,41 @@ class RelValStep(ModelBase):
                 if driver.get('data') and driver.get('fast'):
                     raise Exception('Both --data and --fast are not allowed in the same step')
 
-        ModelBase.__init__(self, json_input, check_attributes)
+        # Index in parent's list of steps, maintained by parent RelVal
+        self.index_in_parent = None
+        # Memoized input step index and eventcontent, valid for one steps generation of parent
+        self.__memo = {}
+        self.__memo_generation = None
         if parent:
             self.parent = weakref.ref(parent)
         else:
             self.parent = None
 
+        ModelBase.__init__(self, json_input, check_attributes)
+
+    def set(self, attribute, value=None):
+        result = ModelBase.set(self, attribute, value)
+        parent = self.parent() if self.parent else None
+        if parent:
+            parent.steps_changed()
+
+        return result
+
+    def __memoized(self, name, function):
+        """
+        Return memoized result of function, results are dropped when parent's
+        steps or any of the steps change
+        """
+        generation = self.parent().steps_generation
+        if self.__memo_generation != generation:
+            self.__memo = {}
+            self.__memo_generation = generation
+
+        if name not in self.__memo:
+            self.__memo[name] = function()
+
+        return self.__memo[name]
+
     def get_prepid(self):
         return 'RelValStep'
 
@@ -171,8 +200,15 @@ class RelValStep(ModelBase):
         """
         Return step's index in parent's list of steps
         """
-        for index, step in enumerate(self.parent().get('steps')):
-            if self == step:
+        all_steps = self.parent().get('steps')
+        index = self.index_in_parent
+        if index is not None and index < len(all_steps) and all_steps[index] is self:
+            return index
+
+        # Index is not maintained for lists that were changed without set
+        for index, step in enumerate(all_steps):
+            if step is self:
+                self.index_in_parent = index
                 return index
 
         raise Exception(f'Step is not a child of {self.parent().get_prepid()}')
@@ -302,7 +338,7 @@ class RelValStep(ModelBase):
 
             return self.__build_das_command(index)
 
-        arguments_dict = deepcopy(self.get('driver'))
+        arguments_dict = self.copy_json(self.get('driver'))
         if custom_fragment:
             arguments_dict['fragment_name'] = custom_fragment
 
@@ -457,6 +493,9 @@ class RelValStep(ModelBase):
         """
         Get index of step that will be used as input step for current step
         """
+        return self.__memoized('input_step_index', self.__find_input_step_index)
+
+    def __find_input_step_index(self):
         all_steps = self.parent().get('steps')
         index = self.get_index_in_parent()
         this_is_harvesting = self.has_step('HARVESTING')
@@ -500,10 +539,16 @@ class RelValStep(ModelBase):
         Return which eventcontent should be used as input for current RelVal step
         """
         if input_step is None:
-            all_steps = self.parent().get('steps')
-            input_step_index = self.get_input_step_index()
-            input_step = all_steps[input_step_index]
+            return self.__memoized('input_eventcontent', self.__find_input_eventcontent)
+
+        return self.__get_input_eventcontent(input_step)
+
+    def __find_input_eventcontent(self):
+        all_steps = self.parent().get('steps')
+        input_step_index = self.get_input_step_index()
+        return self.__get_input_eventcontent(all_steps[input_step_index])
 
+    def __get_input_eventcontent(self, input_step):
         this_is_harvesting = self.has_step('HARVESTING')
         self_step = self.get('driver')['step']
         this_is_alca = self_step and self_step[0].startswith('ALCA')
@@ -1,7 +1,6 @@
 """
 Module that contains Ticket class
 """
-from copy import deepcopy
 from ..model.model_base import ModelBase
 
 class dict_or_list():
@@ -66,6 +65,10 @@ class Ticket(ModelBase):
         'command_steps': [],
         # CPU cores
         'cpu_cores': 1,
+        # Username of creator
+        'created_by': '',
+        # Time of creation
+        'created_on': 0,
         # List of prepids of relvals that were created from this ticket
         'created_relvals': [],
         # GPU parameters that will be added to selected steps
@@ -102,6 +105,8 @@ class Ticket(ModelBase):
         'scram_arch': '',
         # Status is either new or done
         'status': 'new',
+        # Time of last update
+        'updated_on': 0,
         # Workflow ids
         'workflow_ids': [],
         # Input datasets
@@ -143,11 +148,11 @@ class Ticket(ModelBase):
 
     def __init__(self, json_input=None, check_attributes=True):
         if json_input:
-            json_input = deepcopy(json_input)
+            json_input = ModelBase.copy_json(json_input) if check_attributes else dict(json_input)
             json_input['workflow_ids'] = [float(wid) for wid in json_input['workflow_ids']]
             json_input['recycle_gs'] = bool(json_input.get('recycle_gs', False))
             if json_input.get('gpu', {}).get('requires') not in ('optional', 'required'):
-                json_input['gpu'] = self.schema().get('gpu')
+                json_input['gpu'] = self.get_default('gpu')
                 json_input['gpu']['requires'] = 'forbidden'
                 json_input['gpu_steps'] = []
 
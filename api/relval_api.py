@@ -107,9 +107,21 @@ class GetRelValAPI(APIBase):
     def get(self, prepid):
         """
         Get a single with given prepid
+        Use history=full to get full history instead of latest entries
         """
-        obj = relval_controller.get(prepid)
-        return self.output_text({'response': obj.get_json(), 'success': True, 'message': ''})
+        full_history = flask.request.args.get('history') == 'full'
+        obj, revision = relval_controller.get_with_revision(prepid)
+        etag = self.make_etag('relval', prepid, revision, full_history)
+        if self.etag_matches(etag):
+            return self.output_not_modified(etag)
+
+        obj_json = obj.get_json_view()
+        if full_history:
+            obj_json = dict(obj_json)
+            relval_controller.join_history([obj_json])
+
+        return self.output_text({'response': obj_json, 'success': True, 'message': ''},
+                                etag=etag)
 
 class GetEditableRelValAPI(APIBase):
     """
@@ -130,12 +142,12 @@ class GetEditableRelValAPI(APIBase):
                 # Return one object if there is only one prepid
                 relval = relval_controller.get(prepid[0])
                 editing_info = relval_controller.get_editing_info(relval)
-                relval = relval.get_json()
+                relval = relval.get_json_view()
             else:
                 # Return a list if there are multiple prepids
                 relval = [relval_controller.get(p) for p in prepid]
                 editing_info = [relval_controller.get_editing_info(r) for r in relval]
-                relval = [r.get_json() for r in relval]
+                relval = [r.get_json_view() for r in relval]
 
         else:
             relval = RelVal()
@@ -161,9 +173,13 @@ class GetCMSDriverAPI(APIBase):
         """
         Get a text file with RelVal's cmsDriver.py commands
         """
-        relval = relval_controller.get(prepid)
+        relval, revision = relval_controller.get_with_revision(prepid)
+        etag = self.make_etag('cmsdriver', prepid, revision)
+        if self.etag_matches(etag):
+            return self.output_not_modified(etag)
+
         commands = relval_controller.get_cmsdriver(relval)
-        return self.output_text(commands, content_type='text/plain')
+        return self.output_text(commands, content_type='text/plain', etag=etag)
 
 class GetCMSDriverTestAPI(APIBase):
     """
@@ -213,11 +229,15 @@ class GetRelValJobDictAPI(APIBase):
         """
         Get a text file with ReqMgr2's dictionary
         """
-        relval = relval_controller.get(prepid)
+        relval, revision = relval_controller.get_with_revision(prepid)
+        etag = self.make_etag('job_dict', prepid, revision)
+        if self.etag_matches(etag):
+            return self.output_not_modified(etag)
+
         dict_string = json.dumps(relval_controller.get_job_dict(relval),
                                  indent=2,
                                  sort_keys=True)
-        return self.output_text(dict_string, content_type='text/plain')
+        return self.output_text(dict_string, content_type='text/plain', etag=etag)
 
 
 class GetDefaultRelValStepAPI(APIBase):
@@ -1,8 +1,10 @@
 """
 Module that contains all search APIs
 """
+import json
 import re
 import time
+import zlib
 import flask
 from core_lib.api.api_base import APIBase
 from database.database import Database
@@ -20,27 +22,76 @@ class SearchAPI(APIBase):
         self.classes = {'tickets': Ticket,
                         'relvals': RelVal,
                         'relval-tests': RelVal,}
-
-    @APIBase.exceptions_to_errors
-    def get(self):
+        # Named sets of attributes that are returned instead of whole objects
+        self.views = {'tickets': {'ids': ['prepid', 'status'],
+                                  'table': ['prepid', 'status', 'cmssw_release', 'jira_ticket',
+                                            'batch_name', 'cpu_cores', 'label', 'memory',
+                                            'scram_arch', 'workflow_ids', 'notes',
+                                            'created_relvals', 'hlt_gt', 'prompt_gt',
+                                            'express_gt', 'hlt_gt_ref', 'prompt_gt_ref',
+                                            'express_gt_ref']},
+                      'relvals': {'ids': ['prepid', 'status'],
+                                  'table': ['prepid', 'status', 'jira_ticket', 'batch_name',
+                                            'campaign_timestamp', 'cmssw_release', 'cpu_cores',
+                                            'label', 'memory', 'workflow_id', 'workflow_name',
+                                            'workflows.name', 'workflows.status_history'],
+                                  'dqm': ['prepid', 'status', 'jira_ticket', 'output_datasets',
+                                          'workflows.name', 'workflows.status_history',
+                                          'dqm_comparison']}}
+
+    def get_projection(self, db_name, view, fields, exclude):
         """
-        Perform a search
+        Make a database projection out of view name and comma separated lists
+        of attributes to include or exclude
         """
-        args = flask.request.args.to_dict()
-        if args is None:
-            args = {}
+        fields = [f.strip() for f in (fields or '').split(',') if f.strip()]
+        exclude = [e.strip() for e in (exclude or '').split(',') if e.strip()]
+        if view:
+            views = self.views.get(db_name, {})
+            if view not in views:
+                raise Exception(f'Unknown view "{view}", available: {", ".join(sorted(views))}')
+
+            fields.extend(views[view])
+
+        if fields and exclude:
+            raise Exception('Fields and exclude cannot be used together')
+
+        if fields:
+            return {field: 1 for field in fields}
 
+        if exclude:
+            return {attribute: 0 for attribute in exclude}
+
+        return None
+
+    def get_search_arguments(self, args):
+        """
+        Return database and arguments of query_page from request arguments
+        """
         db_name = args.pop('db_name', None)
         page = int(args.pop('page', 0))
         limit = int(args.pop('limit', 2000))
         sort = args.pop('sort', None)
         sort_asc = args.pop('sort_asc', None)
         wild_filter = args.pop('filter', False)
+        continuation = args.pop('continuation', None)
+        count_mode = args.pop('total', Database.COUNT_EXACT)
+        archive = str(args.pop('archive', '')).lower() == 'true'
+        if archive and db_name not in Database.ARCHIVES:
+            raise Exception(f'"{db_name}" does not have an archive')
+
+        if count_mode not in (Database.COUNT_EXACT, Database.COUNT_ESTIMATE, Database.COUNT_NONE):
+            raise Exception(f'Unknown total "{count_mode}"')
+
+        projection = self.get_projection(db_name,
+                                         args.pop('view', None),
+                                         args.pop('fields', None),
+                                         args.pop('exclude', None))
 
         # Special cases
         from_ticket = args.pop('ticket', None)
         if db_name == 'relvals' and from_ticket:
-            ticket_database = Database('tickets')
+            ticket_database = Database('tickets', Database.READ_SEARCH)
             tickets = ticket_database.query(query_string=f'prepid={from_ticket}',
                                             limit=100,
                                             ignore_case=True)
@@ -52,7 +103,11 @@ class SearchAPI(APIBase):
             prepid_query = args.pop('prepid', '')
             args['prepid'] = ('%s,%s' % (prepid_query, created_relvals)).strip(',')
 
-        # Sorting logic: by default sort dsc by cration time
+        # Sorting logic: free text search is sorted by relevance,
+        # otherwise by default sort dsc by cration time
+        if sort is None and wild_filter:
+            sort = Database.SORT_RELEVANCE
+
         if sort is None:
             sort = 'created_on'
 
@@ -65,22 +120,198 @@ class SearchAPI(APIBase):
         limit = max(1, min(limit, 500))
         sort_asc = str(sort_asc).lower() == 'true'
         query_string = '&&'.join(['%s=%s' % (pair) for pair in args.items()])
-        database = Database(db_name)
+        database = Database(db_name, Database.READ_SEARCH, archive)
         query_string = database.build_query_with_types(query_string, self.classes[db_name])
-        results, total_rows = database.query_with_total_rows(query_string=query_string,
-                                                             page=page,
-                                                             limit=limit,
-                                                             sort_attr=sort,
-                                                             sort_asc=sort_asc,
-                                                             ignore_case=True,
-                                                             wild_filter=wild_filter)
+        return database, {'query_string': query_string,
+                          'page': page,
+                          'limit': limit,
+                          'sort_attr': sort,
+                          'sort_asc': sort_asc,
+                          'ignore_case': True,
+                          'wild_filter': wild_filter,
+                          'continuation': continuation,
+                          'count_mode': count_mode,
+                          'projection': projection}
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Perform a search
+        Pass continuation token from previous response to get the next page
+        Total can be exact (default), estimate or none
+        Use fields or exclude with comma separated attributes or a named view
+        to get only part of each object
+        Free text filter is sorted by relevance unless other sort is given
+        Use history=full to get full history instead of latest entries
+        Use archive=true to search archived objects instead of active ones
+        """
+        args = flask.request.args.to_dict()
+        if args is None:
+            args = {}
+
+        full_history = args.pop('history', None) == 'full'
+        database, search_arguments = self.get_search_arguments(args)
+        results, total_rows, continuation = database.query_page(**search_arguments)
+        # Results change if any object is saved, added or removed
+        etag = self.make_etag('search',
+                              flask.request.query_string,
+                              total_rows,
+                              continuation,
+                              [(r.get('_id'), r.get('_rev'), r.get('last_update')) for r in results])
+        if self.etag_matches(etag):
+            return self.output_not_modified(etag)
+
+        if full_history:
+            database.join_history(results)
+
+        response = {'results': results,
+                    'total_rows': total_rows,
+                    'continuation': continuation}
+        wild_filter = search_arguments['wild_filter']
+        if wild_filter:
+            # Attributes where words of free text filter were found
+            response['highlights'] = {r['_id']: database.get_matched_attributes(r, wild_filter)
+                                      for r in results}
+
+        return self.output_text({'response': response,
+                                 'success': True,
+                                 'message': ''},
+                                etag=etag)
+
 
+class SearchExplainAPI(SearchAPI):
+    """
+    Endpoint that shows how a search is run in the database
+    """
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Return MongoDB filter, sort and winning plan of a search with same
+        arguments as search endpoint
+        """
+        args = flask.request.args.to_dict()
+        if args is None:
+            args = {}
+
+        database, search_arguments = self.get_search_arguments(args)
+        search_arguments.pop('count_mode')
+        search_arguments.pop('projection')
+        explained = database.explain_query(**search_arguments)
+        return self.output_text({'response': explained,
+                                 'success': True,
+                                 'message': ''})
+
+
+class SearchChangesAPI(SearchAPI):
+    """
+    Endpoint that is used to get objects that changed since given time
+    """
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Return objects of db_name that were saved or deleted at or after since
+        timestamp, deleted objects have only _id and deleted attributes
+        Follow continuation until it is None and then use watermark as since of
+        the next request
+        Use fields, exclude or view to get only part of each object
+        """
+        args = flask.request.args.to_dict()
+        db_name = args.get('db_name')
+        if db_name not in self.classes:
+            raise Exception(f'Unknown db_name "{db_name}"')
+
+        since = int(args.get('since', 0))
+        limit = max(1, min(int(args.get('limit', 500)), 5000))
+        projection = self.get_projection(db_name,
+                                         args.get('view'),
+                                         args.get('fields'),
+                                         args.get('exclude'))
+        # Changes are read from primary, a lagging secondary would make
+        # clients skip writes that are older than the returned watermark
+        database = Database(db_name)
+        results, continuation, watermark = database.get_changes_page(since,
+                                                                     limit,
+                                                                     args.get('continuation'),
+                                                                     projection)
         return self.output_text({'response': {'results': results,
-                                              'total_rows': total_rows},
+                                              'continuation': continuation,
+                                              'watermark': watermark},
                                  'success': True,
                                  'message': ''})
 
 
+class SearchExportAPI(SearchAPI):
+    """
+    Endpoint that is used to download all results of a search
+    """
+
+    # Size of chunks that are sent to the client
+    CHUNK_SIZE = 65536
+
+    def generate_lines(self, cursor, compress):
+        """
+        Yield chunks of newline delimited JSON of all documents in cursor,
+        optionally gzip compressed
+        """
+        # wbits 31 makes gzip header and trailer
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        lines = []
+        size = 0
+        for document in cursor:
+            line = json.dumps(document, sort_keys=True) + '\n'
+            lines.append(line)
+            size += len(line)
+            if size < self.CHUNK_SIZE:
+                continue
+
+            chunk = ''.join(lines).encode('utf-8')
+            lines = []
+            size = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+
+            if chunk:
+                yield chunk
+
+        chunk = ''.join(lines).encode('utf-8')
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+
+        if chunk:
+            yield chunk
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('user')
+    def get(self):
+        """
+        Stream all results of a search as newline delimited JSON, one object
+        per line, without limit and paging
+        Arguments are same as in search, response is gzip compressed if
+        client accepts gzip encoding
+        """
+        args = flask.request.args.to_dict()
+        if args is None:
+            args = {}
+
+        database, search_arguments = self.get_search_arguments(args)
+        for argument in ('page', 'limit', 'continuation', 'count_mode'):
+            search_arguments.pop(argument)
+
+        cursor = database.query_cursor(**search_arguments)
+        compress = 'gzip' in flask.request.accept_encodings
+        lines = self.generate_lines(cursor, compress)
+        response = flask.Response(flask.stream_with_context(lines),
+                                  mimetype='application/x-ndjson')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+
 class SuggestionsAPI(APIBase):
     """
     Endpoint that is used to fetch suggestions
@@ -105,7 +336,7 @@ class SuggestionsAPI(APIBase):
         if not db_name or not query:
             raise Exception('Bad db_name or query parameter')
 
-        database = Database(db_name)
+        database = Database(db_name, Database.READ_SEARCH)
         db_query = {'prepid': re.compile(f'.*{query}.*', re.IGNORECASE)}
         results = database.collection.find(db_query).limit(limit)
         results = [x['prepid'] for x in results]
@@ -146,8 +377,8 @@ class WildSearchAPI(APIBase):
                                      'success': True,
                                      'message': 'Query string too short'})
 
-        tickets_db = Database('tickets')
-        relvals_db = Database('relvals')
+        tickets_db = Database('tickets', Database.READ_SEARCH)
+        relvals_db = Database('relvals', Database.READ_SEARCH)
 
         attempts = [('relvals', relvals_db, 'prepid', False),
                     ('tickets', tickets_db, 'prepid', False),
@@ -3,11 +3,18 @@ Module that contains all system APIs
 """
 import time
 import os.path
+import flask
 from core_lib.api.api_base import APIBase
 from core_lib.utils.locker import Locker
 from database.database import Database
+from database.query_advisor import QueryAdvisor
+from database.query_language import QueryParser
 from core_lib.utils.user_info import UserInfo
+from core_lib.utils.global_config import Config
 from .utils.submitter import RequestSubmitter
+from .utils.objects_summary import ObjectsSummary
+from .controller.relval_controller import RelValController
+from .controller.ticket_controller import TicketController
 
 
 class SubmissionWorkerStatusAPI(APIBase):
@@ -88,80 +95,15 @@ class ObjectsInfoAPI(APIBase):
     def __init__(self):
         APIBase.__init__(self)
 
-    def get_relvals(self):
-        """
-        Return summary of RelVals by status and submitted RelVals by CMSSW and batch name
-        """
-        start_time = time.time()
-        collection = Database('relvals').collection
-        status_query = [{'$match': {'deleted': {'$ne': True}}},
-                        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
-        by_status = collection.aggregate(status_query)
-
-        batch_query = [{'$match': {'deleted': {'$ne': True}}},
-                       {'$match': {'status': 'submitted'}},
-                       {'$group': {'_id': {'release': '$cmssw_release', 'batch': '$batch_name'},
-                                   'counts': {'$sum': 1}}},
-                       {'$group': {"_id": "$_id.release",
-                                   "batches": {"$push": {"batch_name": "$_id.batch",
-                                                         "count": "$counts"}}}}]
-        by_batch = collection.aggregate(batch_query)
-        by_status = list(by_status)
-        by_batch = list(by_batch)
-        by_batch = sorted(by_batch, key=lambda x: x['_id'], reverse=True)
-        for release in by_batch:
-            release['batches'] = sorted(release['batches'],
-                                        key=lambda x: (x['count'], x['batch_name'].lower()),
-                                        reverse=True)
-
-        statuses = ['new', 'approved', 'submitting', 'submitted', 'done', 'archived']
-        by_status = sorted(by_status, key=lambda x: statuses.index(x['_id']))
-        end_time = time.time()
-        self.logger.debug('Getting objects info - RelVals, time taken %.2fs',
-                          end_time - start_time)
-        return by_status, by_batch
-
-    def get_tickets(self):
-        """
-        Return summary of tickets by status and new tickets by CMSSW and batch name
-        """
-        start_time = time.time()
-        collection = Database('tickets').collection
-        status_query = [{'$match': {'deleted': {'$ne': True}}},
-                        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
-        by_status = collection.aggregate(status_query)
-
-        batch_query = [{'$match': {'deleted': {'$ne': True}}},
-                       {'$match': {'status': 'new'}},
-                       {'$group': {'_id': {'release': '$cmssw_release', 'batch': '$batch_name'},
-                                   'counts': {'$sum': 1}}},
-                       {'$group': {"_id": "$_id.release",
-                                   "batches": {"$push": {"batch_name": "$_id.batch",
-                                                         "count": "$counts"}}}}]
-
-        by_batch = collection.aggregate(batch_query)
-        by_status = list(by_status)
-        by_batch = list(by_batch)
-        by_batch = sorted(by_batch, key=lambda x: x['_id'], reverse=True)
-        for release in by_batch:
-            release['batches'] = sorted(release['batches'],
-                                        key=lambda x: (x['count'], x['batch_name'].lower()),
-                                        reverse=True)
-
-        statuses = ['new', 'done']
-        by_status = sorted(by_status, key=lambda x: statuses.index(x['_id']))
-        end_time = time.time()
-        self.logger.debug('Getting objects info - Tickets, time taken %.2fs',
-                          end_time - start_time)
-        return by_status, by_batch
-
     @APIBase.exceptions_to_errors
     def get(self):
         """
         Get number of RelVals with each status and processing strings of submitted requests
+        Numbers are up to a few minutes old
         """
-        relvals_by_status, relvals_by_batch = self.get_relvals()
-        tickets_by_status, tickets_by_batch = self.get_tickets()
+        summary = ObjectsSummary()
+        relvals_by_status, relvals_by_batch = summary.get('relvals')
+        tickets_by_status, tickets_by_batch = summary.get('tickets')
         return self.output_text({'response': {'relvals' : {'by_status': relvals_by_status,
                                                            'by_batch': relvals_by_batch},
                                               'tickets' : {'by_status': tickets_by_status,
@@ -169,6 +111,18 @@ class ObjectsInfoAPI(APIBase):
                                  'success': True,
                                  'message': ''})
 
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('administrator')
+    def post(self):
+        """
+        Rebuild summary of RelVals and tickets from the database
+        """
+        summary = ObjectsSummary()
+        for collection_name in ObjectsSummary.COLLECTIONS:
+            summary.rebuild(collection_name)
+
+        return self.get()
+
 
 class BuildInfoAPI(APIBase):
     """
@@ -220,4 +174,74 @@ class UptimeInfoAPI(APIBase):
                                               'minutes': minutes,
                                               'seconds': seconds},
                                  'success': True,
-                                 'message': ''})
\ No newline at end of file
+                                 'message': ''})
+
+class QueryStatsAPI(APIBase):
+    """
+    Endpoint for getting statistics of database query shapes
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('administrator')
+    def get(self):
+        """
+        Get query shapes with their timing and whether they ran as collection scans
+        or sorted in memory
+        Add slow=true to get only shapes that were slower than the threshold
+        """
+        slow_only = flask.request.args.get('slow', '').lower() == 'true'
+        stats = QueryAdvisor().get_stats(slow_only)
+        return self.output_text({'response': stats, 'success': True, 'message': ''})
+
+
+class DatabaseCacheAPI(APIBase):
+    """
+    Endpoint for getting statistics of database document cache
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('administrator')
+    def get(self):
+        """
+        Get number of cached documents, hits, misses, evictions and status of
+        change stream watchers and statistics of compiled query filter cache
+        """
+        stats = Database.get_cache_stats()
+        stats['query_filters'] = QueryParser.get_cache_stats()
+        return self.output_text({'response': stats, 'success': True, 'message': ''})
+
+
+class ArchiveAPI(APIBase):
+    """
+    Endpoint for moving old objects and tombstones to archive collections
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('administrator')
+    def post(self):
+        """
+        Move deleted tickets and deleted, done and archived RelVals that were
+        not changed for more than given number of days to archive
+        Add days=<number> to override archive_after_days of configuration
+        """
+        days = int(flask.request.args.get('days', Config.get('archive_after_days', 180)))
+        if days < 1:
+            raise Exception('Number of days must be positive')
+
+        max_age = days * 24 * 3600
+        archived = {'tickets': TicketController().archive(max_age),
+                    'relvals': RelValController().archive(max_age)}
+        summary = ObjectsSummary()
+        for collection_name in ObjectsSummary.COLLECTIONS:
+            summary.rebuild(collection_name)
+
+        return self.output_text({'response': archived, 'success': True, 'message': ''})
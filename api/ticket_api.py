@@ -85,9 +85,21 @@ class GetTicketAPI(APIBase):
     def get(self, prepid):
         """
         Get a single ticket with given prepid
+        Use history=full to get full history instead of latest entries
         """
-        obj = ticket_controller.get(prepid)
-        return self.output_text({'response': obj.get_json(), 'success': True, 'message': ''})
+        full_history = flask.request.args.get('history') == 'full'
+        obj, revision = ticket_controller.get_with_revision(prepid)
+        etag = self.make_etag('ticket', prepid, revision, full_history)
+        if self.etag_matches(etag):
+            return self.output_not_modified(etag)
+
+        obj_json = obj.get_json_view()
+        if full_history:
+            obj_json = dict(obj_json)
+            ticket_controller.join_history([obj_json])
+
+        return self.output_text({'response': obj_json, 'success': True, 'message': ''},
+                                etag=etag)
 
 
 class GetEditableTicketAPI(APIBase):
@@ -109,7 +121,7 @@ class GetEditableTicketAPI(APIBase):
             ticket = Ticket()
 
         editing_info = ticket_controller.get_editing_info(ticket)
-        return self.output_text({'response': {'object': ticket.get_json(),
+        return self.output_text({'response': {'object': ticket.get_json_view(),
                                               'editing_info': editing_info},
                                  'success': True,
                                  'message': ''})
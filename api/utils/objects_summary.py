@@ -0,0 +1,142 @@
+"""
+Module that contains ObjectsSummary class
+"""
+import logging
+import time
+from threading import RLock
+from database.database import Database
+
+
+class ObjectsSummary():
+    """
+    In-memory summary of number of objects by status, CMSSW release and batch name
+    Summary is built with one aggregation per collection, kept up to date with
+    changes made by this process and rebuilt when it gets older than MAX_AGE,
+    so changes made by other processes are visible after at most MAX_AGE seconds
+    """
+
+    # Seconds after which summary is rebuilt from the database
+    MAX_AGE = 300
+    # Order of statuses and status of objects that are grouped by batch
+    COLLECTIONS = {'relvals': {'statuses': ['new', 'approving', 'approved', 'submitting',
+                                            'submitted', 'done', 'archived'],
+                               'batch_status': 'submitted'},
+                   'tickets': {'statuses': ['new', 'done'],
+                               'batch_status': 'new'}}
+    __summaries = {}
+    __summaries_lock = RLock()
+
+    def __init__(self):
+        self.logger = logging.getLogger()
+
+    def get_key(self, object_json):
+        """
+        Return (status, release, batch) of an object or None if it is not counted
+        """
+        if not object_json or object_json.get('deleted'):
+            return None
+
+        return (object_json.get('status'),
+                object_json.get('cmssw_release'),
+                object_json.get('batch_name'))
+
+    def build(self, collection_name):
+        """
+        Count objects of a collection by status, release and batch name
+        """
+        start_time = time.time()
+        collection = Database(collection_name, Database.READ_SEARCH).collection
+        query = [{'$match': {'deleted': {'$ne': True}}},
+                 {'$group': {'_id': {'status': '$status',
+                                     'release': '$cmssw_release',
+                                     'batch': '$batch_name'},
+                             'count': {'$sum': 1}}}]
+        counts = {}
+        for group in collection.aggregate(query):
+            group_id = group['_id']
+            key = (group_id.get('status'), group_id.get('release'), group_id.get('batch'))
+            counts[key] = group['count']
+
+        self.logger.debug('Built objects summary of %s, time taken %.2fs',
+                          collection_name,
+                          time.time() - start_time)
+        return {'built': time.time(), 'counts': counts}
+
+    def rebuild(self, collection_name):
+        """
+        Build summary of a collection from the database and replace the old one
+        """
+        summary = self.build(collection_name)
+        with ObjectsSummary.__summaries_lock:
+            ObjectsSummary.__summaries[collection_name] = summary
+
+        return summary
+
+    def apply_change(self, collection_name, old_json, new_json):
+        """
+        Update summary with a change of an object, old_json is None for created
+        objects and new_json is None for removed objects
+        Summaries that were not built yet are not changed
+        """
+        old_key = self.get_key(old_json)
+        new_key = self.get_key(new_json)
+        if old_key == new_key:
+            return
+
+        with ObjectsSummary.__summaries_lock:
+            summary = ObjectsSummary.__summaries.get(collection_name)
+            if not summary:
+                return
+
+            counts = summary['counts']
+            if old_key:
+                counts[old_key] = counts.get(old_key, 0) - 1
+                if counts[old_key] <= 0:
+                    counts.pop(old_key)
+
+            if new_key:
+                counts[new_key] = counts.get(new_key, 0) + 1
+
+    def apply_status_change(self, collection_name, object_json, old_status):
+        """
+        Update summary with a status change of an object
+        """
+        self.apply_change(collection_name, dict(object_json, status=old_status), object_json)
+
+    def get(self, collection_name):
+        """
+        Return list of counts by status and list of releases with counts of
+        objects by batch name
+        """
+        with ObjectsSummary.__summaries_lock:
+            summary = ObjectsSummary.__summaries.get(collection_name)
+            if summary and time.time() - summary['built'] < ObjectsSummary.MAX_AGE:
+                counts = dict(summary['counts'])
+            else:
+                summary = None
+
+        if not summary:
+            counts = dict(self.rebuild(collection_name)['counts'])
+
+        settings = ObjectsSummary.COLLECTIONS[collection_name]
+        statuses = settings['statuses']
+        by_status = {}
+        by_batch = {}
+        for (status, release, batch), count in counts.items():
+            by_status[status] = by_status.get(status, 0) + count
+            if status == settings['batch_status']:
+                batches = by_batch.setdefault(release, {})
+                batches[batch] = batches.get(batch, 0) + count
+
+        by_status = [{'_id': status, 'count': count} for status, count in by_status.items()]
+        by_status = sorted(by_status,
+                           key=lambda x: (statuses.index(x['_id']) if x['_id'] in statuses
+                                          else len(statuses)))
+        by_batch = [{'_id': release,
+                     'batches': sorted([{'batch_name': batch, 'count': count}
+                                        for batch, count in batches.items()],
+                                       key=lambda x: (x['count'], str(x['batch_name']).lower()),
+                                       reverse=True)}
+                    for release, batches in by_batch.items()]
+        by_batch = sorted(by_batch, key=lambda x: str(x['_id']), reverse=True)
+        return by_status, by_batch
@@ -76,7 +76,6 @@ class RelvalTestSubmitter(BaseSubmitter):
     workspace_dir = Config.get('remote_path').rstrip('/')
     with Locker().get_lock(prepid):
       start_time = time.time()
-      relval_db = Database('relvals')
       def execute_scripts():
         ssh = SSHExecutor('lxplus.cern.ch', credentials_file)
         self.prepare_workspace(relval, controller, ssh, workspace_dir)
@@ -90,8 +89,7 @@ class RelvalTestSubmitter(BaseSubmitter):
       if exit_code:
         for step in relval.get('steps'):
           step.set('resolved_globaltag', '')
-        relval.set('status', 'new')
-        relval.add_history('approval', 'failed', 'automatic')
+        controller.transition(relval, 'new', ('steps', ), 'approval', 'failed', 'automatic')
       else:
         try:
           # Setting optimal params in relval
@@ -104,10 +102,8 @@ class RelvalTestSubmitter(BaseSubmitter):
               step.set(p, value)
         except Exception as e:
           print(e)
-        relval.set('status', 'approved')
-        relval.add_history('approval', 'succeeded', 'automatic')
+        controller.transition(relval, 'approved', ('steps', ), 'approval', 'succeeded', 'automatic')
         print('SUCCESS: ', time.time()-start_time, ' sec')
-      relval_db.save(relval.get_json())
     return relval
 
   def prepare_workspace(self, relval, controller, ssh_executor, workspace_dir):
@@ -28,19 +28,21 @@ class RequestSubmitter(BaseSubmitter):
                          relval=relval,
                          controller=relval_controller)
 
-    def __handle_error(self, relval, error_message):
+    def __handle_error(self, relval, error_message, controller):
         """
         Handle error that occured during submission, modify RelVal accordingly
         """
         self.logger.error(error_message)
-        relval_db = Database('relvals')
-        relval.set('status', 'approved')
         relval.set('campaign_timestamp', 0)
-        relval.add_history('submission', 'failed', 'automatic')
         for step in relval.get('steps'):
             step.set('config_id', '')
 
-        relval_db.save(relval.get_json())
+        controller.transition(relval,
+                              'approved',
+                              ('campaign_timestamp', 'steps'),
+                              'submission',
+                              'failed',
+                              'automatic')
         service_url = Config.get('service_url')
         emailer = Emailer()
         prepid = relval.get_prepid()
@@ -219,7 +221,6 @@ class RequestSubmitter(BaseSubmitter):
         self.logger.debug('Will try to acquire lock for %s', prepid)
         with Locker().get_lock(prepid):
             self.logger.info('Locked %s for submission', prepid)
-            relval_db = Database('relvals')
             relval = controller.get(prepid)
             try:
                 self.check_for_submission(relval)
@@ -247,15 +248,18 @@ class RequestSubmitter(BaseSubmitter):
                 workflow_name = self.submit_job_dict(job_dict, connection)
                 # Update RelVal after successful submission
                 relval.set('workflows', [{'name': workflow_name}])
-                relval.set('status', 'submitted')
-                relval.add_history('submission', 'succeeded', 'automatic')
-                relval_db.save(relval.get_json())
+                controller.transition(relval,
+                                      'submitted',
+                                      ('workflows', 'steps'),
+                                      'submission',
+                                      'succeeded',
+                                      'automatic')
                 time.sleep(3)
                 self.approve_workflow(workflow_name, connection)
                 connection.close()
 
             except Exception as ex:
-                self.__handle_error(relval, str(ex))
+                self.__handle_error(relval, str(ex), controller)
                 return
 
             self.__handle_success(relval)
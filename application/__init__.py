@@ -8,8 +8,10 @@ from colorlog import ColoredFormatter
 from flask import Flask, render_template, request, session, g
 from flask_restful import Api
 from flask_cors import CORS
+from pymongo import ASCENDING, DESCENDING, TEXT
 from jinja2.exceptions import TemplateNotFound
 from database.database import Database
+from database.migrations import Migrations
 from core_lib.utils.global_config import Config
 from core_lib.utils.username_filter import UsernameFilter
 
@@ -117,11 +119,20 @@ def create_app():
                                 SubmissionQueueAPI,
                                 ObjectsInfoAPI,
                                 BuildInfoAPI,
-                                UptimeInfoAPI
+                                UptimeInfoAPI,
+                                QueryStatsAPI,
+                                DatabaseCacheAPI,
+                                ArchiveAPI
                                 )
     from api.settings_api import SettingsAPI
 
-    from api.search_api import SearchAPI, SuggestionsAPI, WildSearchAPI
+    from api.search_api import (SearchAPI,
+                                SearchExplainAPI,
+                                SearchChangesAPI,
+                                SearchExportAPI,
+                                SuggestionsAPI,
+                                WildSearchAPI
+                                )
 
     from api.jira_api import (GetJiraTicketsAPI,
                               CreateJiraTicketAPI
@@ -210,11 +221,17 @@ def create_app():
     api.add_resource(ObjectsInfoAPI, '/api/system/objects_info')
     api.add_resource(BuildInfoAPI, '/api/system/build_info')
     api.add_resource(UptimeInfoAPI, '/api/system/uptime')
+    api.add_resource(QueryStatsAPI, '/api/system/query_stats')
+    api.add_resource(DatabaseCacheAPI, '/api/system/cache')
+    api.add_resource(ArchiveAPI, '/api/system/archive')
     api.add_resource(SettingsAPI,
                      '/api/settings/get',
                      '/api/settings/get/<string:name>')
 
     api.add_resource(SearchAPI, '/api/search')
+    api.add_resource(SearchExplainAPI, '/api/search/explain')
+    api.add_resource(SearchChangesAPI, '/api/search/changes')
+    api.add_resource(SearchExportAPI, '/api/search/export')
     api.add_resource(SuggestionsAPI, '/api/suggestions')
     api.add_resource(WildSearchAPI, '/api/wild_search')
 
@@ -265,16 +282,105 @@ def create_app():
     # Init database connection
     Database.set_database_name('relval')
     Database.set_credentials(os.getenv('DATABASE_USER'), os.getenv('DATABASE_PASSWORD'))
-    Database.add_search_rename('tickets', 'created_on', 'history.0.time')
-    Database.add_search_rename('tickets', 'created_by', 'history.0.user')
+    Database.set_client_options(config.get('database_max_pool_size'),
+                                config.get('database_max_idle_time'),
+                                config.get('database_server_selection_timeout'))
+    Database.set_read_preference(Database.READ_SEARCH,
+                                 config.get('database_search_read_preference'),
+                                 config.get('database_search_max_staleness'))
     Database.add_search_rename('tickets', 'workflows', 'workflow_ids<float>')
-    Database.add_search_rename('relvals', 'created_on', 'history.0.time')
-    Database.add_search_rename('relvals', 'created_by', 'history.0.user')
     Database.add_search_rename('relvals', 'workflows', 'workflows.name')
     Database.add_search_rename('relvals', 'workflow', 'workflows.name')
     Database.add_search_rename('relvals', 'output_dataset', 'output_datasets')
+    Database.add_index('tickets', 'status')
+    Database.add_index('tickets', 'deleted')
+    Database.add_index('tickets', [('cmssw_release', ASCENDING), ('batch_name', ASCENDING)])
+    Database.add_index('tickets', 'created_relvals')
+    Database.add_index('tickets', 'jira_ticket')
+    Database.add_index('tickets', 'workflow_ids')
+    # Sorts have _id as tie-breaker, so sorted attributes are indexed with it
+    Database.add_index('tickets', [('created_on', DESCENDING), ('_id', DESCENDING)])
+    Database.add_index('tickets', [('updated_on', DESCENDING), ('_id', DESCENDING)])
+    Database.add_index('tickets', [('last_update', ASCENDING), ('_id', ASCENDING)])
+    Database.add_index('tickets',
+                       [(attribute, TEXT) for attribute in ('prepid', 'cmssw_release',
+                                                            'batch_name', 'jira_ticket',
+                                                            'label', 'notes',
+                                                            'created_relvals', 'status')],
+                       name='text_search',
+                       weights={'prepid': 10, 'jira_ticket': 10, 'batch_name': 5,
+                                'cmssw_release': 5, 'label': 3})
+    Database.add_index('relvals', 'status')
+    Database.add_index('relvals', 'deleted')
+    Database.add_index('relvals', [('cmssw_release', ASCENDING),
+                                   ('batch_name', ASCENDING),
+                                   ('campaign_timestamp', ASCENDING)])
+    Database.add_index('relvals', 'jira_ticket')
+    Database.add_index('relvals', 'workflows.name')
+    Database.add_index('relvals', 'output_datasets')
+    # Sorts have _id as tie-breaker, so sorted attributes are indexed with it
+    Database.add_index('relvals', [('created_on', DESCENDING), ('_id', DESCENDING)])
+    Database.add_index('relvals', [('updated_on', DESCENDING), ('_id', DESCENDING)])
+    Database.add_index('relvals', [('last_update', ASCENDING), ('_id', ASCENDING)])
+    Database.add_index('relvals',
+                       [(attribute, TEXT) for attribute in ('prepid', 'workflow_name',
+                                                            'cmssw_release', 'batch_name',
+                                                            'jira_ticket', 'label',
+                                                            'sample_tag', 'notes',
+                                                            'output_datasets',
+                                                            'workflows.name', 'status')],
+                       name='text_search',
+                       weights={'prepid': 10, 'workflows.name': 10, 'jira_ticket': 10,
+                                'workflow_name': 5, 'batch_name': 5, 'cmssw_release': 5,
+                                'output_datasets': 3, 'label': 3})
+    # Lowercase copies for case insensitive search
+    for attribute in ('prepid', 'status', 'cmssw_release', 'batch_name', 'jira_ticket',
+                      'label', 'created_relvals', 'created_by'):
+        Database.add_lowercase_attribute('tickets', attribute)
+
+    for attribute in ('prepid', 'status', 'cmssw_release', 'batch_name', 'jira_ticket',
+                      'label', 'workflow_name', 'sample_tag', 'workflows.name',
+                      'output_datasets', 'created_by'):
+        Database.add_lowercase_attribute('relvals', attribute)
+
+    # Full history is kept in separate collections
+    Database.add_history_store('tickets')
+    Database.add_history_store('relvals')
+    Database.add_archive('tickets')
+    Database.add_archive('relvals')
+
+    # Relval tests, settings, counters and migrations are only looked up by _id
+    Database.add_index('relval-tests', '_id')
+    Database.add_index('settings', '_id')
+    Database.add_index('counters', '_id')
+    Database.add_index('migrations', '_id')
+
+    # Creation and update time and creator used to be only in history
+    created_pipeline = [{'$set': {
+        'created_on': {'$ifNull': [{'$arrayElemAt': ['$history.time', 0]}, 0]},
+        'created_by': {'$ifNull': [{'$arrayElemAt': ['$history.user', 0]}, '']},
+        'updated_on': {'$ifNull': [{'$arrayElemAt': ['$history.time', -1]}, 0]}}}]
+    for collection in ('tickets', 'relvals'):
+        Migrations.add(f'created-on-{collection}',
+                       lambda c=collection: Database(c).update_many(
+                           {'created_on': {'$exists': False}, 'deleted': {'$ne': True}},
+                           created_pipeline))
+
+    for collection in Database.HISTORY:
+        Migrations.add(f'history-store-{collection}',
+                       lambda c=collection: Database(c).move_history_to_store())
+
+    for collection, attributes in Database.LOWERCASE.items():
+        # Name contains attributes, so adding an attribute updates all documents
+        Migrations.add(f'lowercase-{collection}-{",".join(attributes)}',
+                       lambda c=collection: Database(c).update_lowercase_attributes())
 
     debug = config.get('development', False)
     logger = setup_logging(debug)
     logger.info('Starting... Debug: ')
+    Database.ensure_indexes()
+    # Backfills run in the background, in one process at a time
+    Migrations.start()
+    Database.set_cache(config.get('database_cache_size', 0), config.get('database_cache_timeout', 60))
+    Database.start_cache_watchers(['relvals', 'tickets', 'relval-tests', 'settings'])
     return app
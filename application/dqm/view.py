@@ -43,7 +43,7 @@ def get_dataset_choices(relvals):
 @dqm_blueprint.route('/dqm/compare', methods=['GET', 'PUT', 'POST'])
 def compare_dqm():
     user = get_userinfo()
-    query_string = 'status=submitted|done'
+    query_string = 'status=submitted|done&fields=jira_ticket'
     response = askfor.get('api/search?db_name=relvals' +'&'+ query_string).json()
     jira_tickets = {res['jira_ticket'] for res in response['response']['results']}
     jira_tickets.discard('None')
@@ -55,7 +55,7 @@ def compare_dqm():
 
     if form.data:
         query_string = 'jira_ticket='+form.data['jira_ticket']+'&status=submitted|done'
-        response = askfor.get('api/search?db_name=relvals' +'&'+ query_string).json()
+        response = askfor.get('api/search?db_name=relvals&view=dqm' +'&'+ query_string).json()
         relvals = response['response']['results']
         choices = [[v[1], v[1]] for v in get_dataset_choices(relvals) if v[2] in good_status]
         for myset in form.Set:
@@ -85,7 +85,7 @@ from .DQMTable import DQMTable
 @dqm_blueprint.route('/dqm/plots', methods=['GET'])
 def dqm_plots():
     user = get_userinfo()
-    response = askfor.get('api/search?db_name=relvals&status=submitted|done'+'&'+ request.query_string.decode()).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm&status=submitted|done'+'&'+ request.query_string.decode()).json()
     mdata = response['response']['results']
     data = copy(mdata)
     for item in mdata:
@@ -141,14 +141,14 @@ def getValidJSON(jsonset):
 
 @dqm_blueprint.route('/dqm/get_submitted_dataset/<jira>')
 def get_submitted_dataset(jira):
-    response = askfor.get('api/search?db_name=relvals&status=submitted|done' +'&jira_ticket='+jira).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm&status=submitted|done' +'&jira_ticket='+jira).json()
     relvals = response['response']['results']
     choices = get_dataset_choices(relvals)
     return jsonify({'datasets': choices})
 
 @dqm_blueprint.route('/dqm/update_workflows/<jira>')
 def update_workflows_for_jira(jira):
-    response = askfor.get('api/search?db_name=relvals&status=submitted|done' +'&jira_ticket='+jira).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm&status=submitted|done' +'&jira_ticket='+jira).json()
     relvals = response['response']['results']
     status = update_workflows(relvals)
     return jsonify(status[0])
@@ -166,7 +166,7 @@ def add_set():
 
     form = SetForm(data=copiedjson)
     query_string = 'jira_ticket='+copiedjson['jira_ticket']+'&status=submitted|done'
-    response = askfor.get('api/search?db_name=relvals' +'&'+ query_string).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm' +'&'+ query_string).json()
     relvals = response['response']['results']
     choices = [[v[1], v[1]] for v in get_dataset_choices(relvals) if v[2] in good_status]
     for myset in form.Set:
@@ -182,7 +182,7 @@ def add_defualt_pairs(jira_ticket):
     """Endpoint for getting list of default pairs in html form"""
 
     query_string = 'jira_ticket='+jira_ticket+'&status=submitted|done'
-    response = askfor.get('api/search?db_name=relvals' +'&'+ query_string).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm' +'&'+ query_string).json()
     relvals = response['response']['results']
     choices = [[v[1], v[1]] for v in get_dataset_choices(relvals) if v[2] in good_status]
 
@@ -222,7 +222,7 @@ def delete_set(setid):
     copiedjson['Set'].pop(setid-1)
     form = SetForm(data=copiedjson)
     query_string = 'jira_ticket='+copiedjson['jira_ticket']+'&status=submitted|done'
-    response = askfor.get('api/search?db_name=relvals' +'&'+ query_string).json()
+    response = askfor.get('api/search?db_name=relvals&view=dqm' +'&'+ query_string).json()
     relvals = response['response']['results']
     choices = [[v[1], v[1]] for v in get_dataset_choices(relvals) if v[2] in good_status]
     for myset in form.Set:
@@ -22,7 +22,7 @@ relval_blueprint = Blueprint('relvals', __name__, url_prefix='/relvals', templat
 # @relval_blueprint.route('', strict_slashes=False, methods=['GET'])
 def get_relval():
     user = get_userinfo()
-    response = askfor.get('api/search?db_name=relvals' +'&'+ request.query_string.decode()).json()
+    response = askfor.get('api/search?db_name=relvals&view=table' +'&'+ request.query_string.decode()).json()
     items = response['response']['results']
     table = RelvalTable(items, classes=['table', 'table-hover'])
 
@@ -123,7 +123,7 @@ from .Table import ItemTable
 @ticket_blueprint.route('', strict_slashes=False, methods=['GET'])
 def tickets():
     user = get_userinfo()
-    response = askfor.get('api/search?db_name=tickets' +'&'+ request.query_string.decode()).json()
+    response = askfor.get('api/search?db_name=tickets&view=table' +'&'+ request.query_string.decode()).json()
     items = response['response']['results']
     table = ItemTable(items, classes=['table', 'table-hover'])
     itemdict = DictObj({value['_id']: value for value in items})
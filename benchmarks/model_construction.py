@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of construction of RelVal objects
+Run from repository root: python3 -m benchmarks.model_construction
+"""
+import json
+import timeit
+from copy import deepcopy
+from api.model.relval import RelVal
+
+
+def make_relval_json(steps=10):
+    """
+    Return JSON of a RelVal with given number of steps
+    """
+    relval_json = {'prepid': 'CMSSW_13_0_0__benchmark-RelValTTbar_14TeV-00001',
+                   'batch_name': 'benchmark',
+                   'cmssw_release': 'CMSSW_13_0_0',
+                   'cpu_cores': 8,
+                   'history': [{'action': 'create',
+                                'time': 1700000000,
+                                'user': 'benchmark',
+                                'value': 'CMSSW_13_0_0__benchmark-RelValTTbar_14TeV-00001'}],
+                   'label': 'benchmark',
+                   'matrix': 'upgrade',
+                   'memory': 16000,
+                   'sample_tag': 'Run3',
+                   'status': 'new',
+                   'steps': [],
+                   'workflow_id': 11634.0,
+                   'workflow_name': 'TTbar_14TeV'}
+    for index in range(steps):
+        relval_json['steps'].append({'name': f'Step{index + 1}_TTbar_14TeV',
+                                     'cmssw_release': 'CMSSW_13_0_0',
+                                     'config_id': '',
+                                     'driver': {'--conditions': 'auto:phase1_2022_realistic',
+                                                '--datatier': ['GEN-SIM', 'RAW'],
+                                                '--era': 'Run3',
+                                                '--eventcontent': ['FEVTDEBUG'],
+                                                '--geometry': 'DB:Extended',
+                                                '--mc': True,
+                                                '--number': '10',
+                                                '--nStreams': '2',
+                                                '--step': ['GEN', 'SIM', 'DIGI', 'L1', 'HLT'],
+                                                '--beamspot': 'Run3RoundOptics25ns13TeVLowSigmaZ'},
+                                     'events_per_lumi': '',
+                                     'gpu': {'requires': 'forbidden'},
+                                     'input': {},
+                                     'keep_output': True,
+                                     'lumis_per_job': '',
+                                     'resolved_globaltag': '',
+                                     'scram_arch': '',
+                                     'size_per_event': 3000.1,
+                                     'time_per_event': 20.1})
+
+    return relval_json
+
+
+def main():
+    """
+    Print time of constructing checked and unchecked 10 step RelVals
+    """
+    relval_json = RelVal(make_relval_json()).get_json()
+    number = 500
+    results = {}
+    cases = (('checked', lambda: RelVal(relval_json)),
+             ('unchecked', lambda: RelVal(relval_json, False)),
+             ('unchecked with steps', lambda: RelVal(relval_json, False).get('steps')))
+    for name, function in cases:
+        timer = timeit.Timer(function)
+        best = min(timer.repeat(repeat=5, number=number)) / number
+        results[name] = f'{best * 1000000:.0f} us'
+
+    copy_timer = timeit.Timer(lambda: deepcopy(relval_json))
+    best = min(copy_timer.repeat(repeat=5, number=number)) / number
+    results['input deepcopy'] = f'{best * 1000000:.0f} us'
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Micro-benchmark of serialization of RelVal objects to API responses
+Run from repository root: python3 -m benchmarks.serialization
+"""
+import json
+import timeit
+from api.model.relval import RelVal
+from benchmarks.model_construction import make_relval_json
+
+
+def serialize(relval_json):
+    """
+    Serialize JSON the same way as APIBase.output_text
+    """
+    return json.dumps({'response': relval_json, 'success': True, 'message': ''},
+                      indent=2,
+                      sort_keys=True)
+
+
+def main():
+    """
+    Print time of serializing unchecked 10 step RelVals with get_json and
+    get_json_view, with steps as stored JSON and with steps made to objects
+    """
+    relval_json = RelVal(make_relval_json()).get_json()
+    relval = RelVal(relval_json, False)
+    relval_with_steps = RelVal(relval_json, False)
+    relval_with_steps.get('steps')
+    assert serialize(relval.get_json()) == serialize(relval.get_json_view())
+    assert serialize(relval_with_steps.get_json()) == serialize(relval_with_steps.get_json_view())
+    number = 500
+    results = {}
+    cases = (('get_json', lambda: serialize(relval.get_json())),
+             ('get_json_view', lambda: serialize(relval.get_json_view())),
+             ('get_json with steps', lambda: serialize(relval_with_steps.get_json())),
+             ('get_json_view with steps', lambda: serialize(relval_with_steps.get_json_view())))
+    for name, function in cases:
+        timer = timeit.Timer(function)
+        best = min(timer.repeat(repeat=5, number=number)) / number
+        results[name] = f'{best * 1000000:.0f} us'
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,16 @@
 """
 API base module
 """
+import hashlib
 import json
 import logging
+import os
 import traceback
 import time
 from flask import request, make_response
 from flask_restful import Resource
 from ..utils.user_info import UserInfo
-from ..utils.exceptions import ObjectNotFound, ObjectAlreadyExists
+from ..utils.exceptions import ObjectNotFound, ObjectAlreadyExists, ObjectConflict
 
 
 class APIBase(Resource):
@@ -22,6 +24,8 @@ class APIBase(Resource):
     }
     """
 
+    __etag_salt = None
+
     def __init__(self):
         Resource.__init__(self)
         self.logger = logging.getLogger()
@@ -142,13 +146,50 @@ class APIBase(Resource):
         if isinstance(exception, ObjectNotFound):
             return 404
 
-        if isinstance(exception, ObjectAlreadyExists):
+        if isinstance(exception, (ObjectAlreadyExists, ObjectConflict)):
             return 409
 
         return 400
 
     @staticmethod
-    def output_text(data, code=200, headers=None, content_type='application/json'):
+    def make_etag(*values):
+        """
+        Make an ETag out of values that identify a version of the response
+        ETags change with every deployment that has release_timestamp file,
+        because same objects might be returned differently by a new version
+        Without the file, ETags depend only on the values, so that all
+        processes return the same ETags
+        """
+        if APIBase.__etag_salt is None:
+            salt = ''
+            if os.path.isfile('release_timestamp'):
+                with open('release_timestamp') as timestamp_file:
+                    salt = timestamp_file.read().strip()
+
+            APIBase.__etag_salt = salt
+
+        values = json.dumps([APIBase.__etag_salt] + list(values), default=str)
+        return hashlib.sha1(values.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def etag_matches(etag):
+        """
+        Return whether client already has the response with given ETag
+        """
+        return request.if_none_match.contains(etag)
+
+    @staticmethod
+    def output_not_modified(etag):
+        """
+        Makes a Flask 304 Not Modified response without a body
+        """
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        return resp
+
+    @staticmethod
+    def output_text(data, code=200, headers=None, content_type='application/json', etag=None):
         """
         Makes a Flask response with a plain text encoded body
         """
@@ -157,6 +198,9 @@ class APIBase(Resource):
         else:
             resp = make_response(data, code)
 
+        if etag:
+            resp.set_etag(etag)
+
         resp.headers.extend(headers or {})
         resp.headers['Content-Type'] = content_type
         resp.headers['Access-Control-Allow-Origin'] = '*'
@@ -3,10 +3,14 @@ Module that contains ControllerBase class
 """
 import json
 import logging
+import time
+from copy import deepcopy
 from database.database import Database
+from database.query_language import Query
 from core_lib.model.model_base import ModelBase
 from core_lib.utils.locker import Locker
-from core_lib.utils.exceptions import ObjectNotFound, ObjectAlreadyExists
+from core_lib.utils.exceptions import ObjectNotFound, ObjectAlreadyExists, ObjectConflict
+from core_lib.utils.json_patch import make_patch, get_changed_paths
 
 
 class ControllerBase():
@@ -18,6 +22,9 @@ class ControllerBase():
     It requires database name and class object of model
     """
 
+    # How many times update is attempted if object is changed by another request
+    UPDATE_ATTEMPTS = 3
+
     def __init__(self):
         self.logger = logging.getLogger()
         self.locker = Locker()
@@ -28,39 +35,78 @@ class ControllerBase():
         """
         Create a new object from given json_data
         """
-        json_data['history'] = []
-        if '_id' in json_data:
-            del json_data['_id']
-
-        new_object = self.model_class(json_input=json_data)
+        new_object = self.make_new_object(json_data)
         prepid = new_object.get_prepid()
 
         database = Database(self.database_name)
-        if database.get(prepid):
+        if database.document_exists(prepid):
             raise ObjectAlreadyExists(prepid, self.database_name)
 
         with self.locker.get_lock(prepid):
             self.logger.info('Will create %s', (prepid))
-            new_object.add_history('create', prepid, None)
             if not self.check_for_create(new_object):
                 self.logger.error('Error while checking new item %s', prepid)
                 return None
 
             self.before_create(new_object)
-            if not database.save(new_object.get_json()):
+            # Revision 0 - object must not exist yet
+            if not database.save(new_object.get_json(), 0):
                 raise Exception(f'Error saving {prepid} to database')
 
             self.after_create(new_object)
 
         return new_object
 
+    def create_many(self, json_list):
+        """
+        Create several new objects with a single write, all or nothing
+        All objects are built and checked before anything is written
+        """
+        new_objects = [self.make_new_object(json_data) for json_data in json_list]
+        for new_object in new_objects:
+            if not self.check_for_create(new_object):
+                raise Exception(f'Error while checking new item {new_object.get_prepid()}')
+
+        for new_object in new_objects:
+            self.before_create(new_object)
+
+        database = Database(self.database_name)
+        self.logger.info('Will create %s objects', len(new_objects))
+        database.insert_many([new_object.get_json() for new_object in new_objects])
+        for new_object in new_objects:
+            self.after_create(new_object)
+
+        return new_objects
+
+    def make_new_object(self, json_data):
+        """
+        Build a new object from given json_data with a fresh creation history
+        """
+        json_data['history'] = []
+        if '_id' in json_data:
+            del json_data['_id']
+
+        new_object = self.model_class(json_input=json_data)
+        new_object.add_history('create', new_object.get_prepid(), None)
+        created = new_object.get('history')[-1]
+        new_object.set('created_on', created['time'])
+        new_object.set('created_by', created['user'])
+        new_object.set('updated_on', created['time'])
+        return new_object
+
     def get(self, prepid, deleted=False):
         """
         Return a single object if it exists in database
         If deleted is True, return a deleted object
         """
+        return self.get_with_revision(prepid, deleted)[0]
+
+    def get_with_revision(self, prepid, deleted=False):
+        """
+        Return a single object and its revision that changes on every save
+        """
         database = Database(self.database_name)
-        object_json = database.get(prepid)
+        object_json = database.get(prepid, keep_revision=True)
         self.logger.debug('Fetched object for prepid %s: %s',
                           prepid,
                           json.dumps(object_json, indent=2))
@@ -71,7 +117,8 @@ class ControllerBase():
             # Object existed, but was deleted
             raise ObjectNotFound(prepid)
 
-        return self.model_class(json_input=object_json, check_attributes=False)
+        revision = object_json.pop('_rev', 0)
+        return self.model_class(json_input=object_json, check_attributes=False), revision
 
     def update(self, new_object, force_update=False):
         """
@@ -82,37 +129,108 @@ class ControllerBase():
             new_object = self.model_class(json_input=new_object)
 
         prepid = new_object.get_prepid()
+        new_object_json = new_object.get_json()
         with self.locker.get_nonblocking_lock(prepid):
             self.logger.info('Will edit %s', prepid)
             database = Database(self.database_name)
-            old_object_json = database.get(prepid)
-            if not old_object_json:
-                raise ObjectNotFound(prepid)
-
-            old_object = self.model_class(json_input=old_object_json, check_attributes=False)
-            # Move over history, so it could not be overwritten
-            new_object.set('history', old_object.get('history'))
-            changed_values = self.get_changes(old_object_json, new_object.get_json())
-            if not changed_values:
-                # Nothing was updated
-                self.logger.info('Nothing was updated for %s', prepid)
-                return old_object.get_json()
-
-            if not force_update:
-                if not self.edit_allowed(old_object, new_object, changed_values):
-                    self.logger.error('Editing was not allowed for %s', prepid)
-
-                new_object.add_history('update', changed_values, None)
-                if not self.check_for_update(old_object, new_object, changed_values):
-                    self.logger.error('Error while updating %s', prepid)
-                    return None
-
-            self.before_update(old_object, new_object, changed_values)
-            if not database.save(new_object.get_json()):
-                raise Exception(f'Error saving {prepid} to database')
+            for attempt in range(1, self.UPDATE_ATTEMPTS + 1):
+                if attempt > 1:
+                    # Start over from the object as it was given
+                    new_object = self.model_class(json_input=deepcopy(new_object_json))
+
+                old_object_json = database.get(prepid, keep_revision=True)
+                if not old_object_json:
+                    raise ObjectNotFound(prepid)
+
+                revision = old_object_json.pop('_rev', None)
+                old_object = self.model_class(json_input=old_object_json, check_attributes=False)
+                # Move over history and timestamps, so they could not be overwritten
+                new_object.set('history', old_object.get('history'))
+                for attribute, default in (('created_on', 0), ('created_by', ''), ('updated_on', 0)):
+                    new_object.set(attribute, old_object_json.get(attribute, default))
+
+                changed_values = self.get_changes(old_object_json, new_object.get_json())
+                if not changed_values:
+                    # Nothing was updated
+                    self.logger.info('Nothing was updated for %s', prepid)
+                    return old_object.get_json()
+
+                if not force_update:
+                    if not self.edit_allowed(old_object, new_object, changed_values):
+                        self.logger.error('Editing was not allowed for %s', prepid)
+
+                    new_object.add_history('update', changed_values, None)
+                    if not self.check_for_update(old_object, new_object, changed_values):
+                        self.logger.error('Error while updating %s', prepid)
+                        return None
+
+                new_object.set('updated_on', int(time.time()))
+                self.before_update(old_object, new_object, changed_values)
+                # Only changed attributes are written
+                saved_json = new_object.get_json()
+                patch = make_patch(old_object_json, saved_json)
+                try:
+                    if not database.save_changes(saved_json, revision, patch):
+                        raise Exception(f'Error saving {prepid} to database')
+
+                except ObjectConflict:
+                    if attempt == self.UPDATE_ATTEMPTS:
+                        raise
+
+                    self.logger.warning('%s was changed while updating, attempt %s/%s',
+                                        prepid,
+                                        attempt,
+                                        self.UPDATE_ATTEMPTS)
+                    continue
+
+                self.after_update(old_object, new_object, changed_values)
+                return new_object.get_json()
+
+    def transition(self, obj, status, attributes=(), action='status', value=None, user=None,
+                   timestamp=None):
+        """
+        Move object from its current status to a new status with a single write
+        that fails with ObjectConflict if status in the database is different
+        Attributes are names of other attributes that were changed in the object
+        and are saved together with the status
+        History entry with action and value (new status by default) is added
+        """
+        prepid = obj.get_prepid()
+        expected_status = obj.get('status')
+        obj.add_history(action, status if value is None else value, user, timestamp)
+        obj_json = obj.get_json()
+        history_entry = obj_json['history'][-1]
+        changes = {attribute: obj_json[attribute] for attribute in attributes}
+        # Timestamp might be in the past, it is used only for the history entry
+        changes['updated_on'] = int(time.time())
+        database = Database(self.database_name)
+        database.transition(prepid, expected_status, status, history_entry, changes)
+        obj.set('updated_on', changes['updated_on'])
+        obj.set('status', status)
+        self.logger.info('Moved %s from "%s" to "%s"', prepid, expected_status, status)
+        self.after_transition(obj, expected_status)
+        return obj
 
-            self.after_update(old_object, new_object, changed_values)
-            return new_object.get_json()
+    def archive(self, max_age):
+        """
+        Move objects that were not changed for max_age seconds and are not
+        needed in daily operations to archive, return number of archived objects
+        """
+        database = Database(self.database_name)
+        return database.archive(self.get_archive_query(int(time.time()) - max_age))
+
+    def get_archive_query(self, changed_before):
+        """
+        Return query of objects that can be archived if they were not changed
+        since changed_before timestamp, by default only deleted objects
+        """
+        return {'deleted': True, 'last_update': {'$lt': changed_before}}
+
+    def join_history(self, objects_json):
+        """
+        Replace latest history entries of objects with their full history
+        """
+        return Database(self.database_name).join_history(objects_json)
 
     def delete(self, json_data):
         """
@@ -192,6 +310,12 @@ class ControllerBase():
         Actions to be performed after object is deleted
         """
         return
+
+    def after_transition(self, obj, old_status):
+        """
+        Actions to be performed after object is moved to a new status
+        """
+        return
     #pylint: enable=no-self-use,unused-argument
 
     def get_editing_info(self, obj):
@@ -224,52 +348,58 @@ class ControllerBase():
 
         return True
 
-    def get_changes(self, reference, target, prefix=None, changed_values=None):
+    def get_changes(self, reference, target):
         """
-        Get dictionary of different values across two objects
+        Get list of attributes that are different across two objects, e.g.
+        steps[1].driver.era, items that were added to or removed from lists
+        are listed by their index, e.g. steps[3]
         """
-        if changed_values is None:
-            changed_values = []
-
-        if prefix is None:
-            prefix = ''
-
         if isinstance(reference, ModelBase):
             reference = reference.get_json()
 
         if isinstance(target, ModelBase):
             target = target.get_json()
 
-        if isinstance(reference, dict) and isinstance(target, dict):
-            # Comparing two dictionaries
-            keys = set(reference.keys()).union(set(target.keys()))
-            for key in keys:
-                self.get_changes(reference.get(key),
-                                 target.get(key),
-                                 '%s.%s' % (prefix, key),
-                                 changed_values)
-        elif isinstance(reference, list) and isinstance(target, list):
-            # Comparing two lists
-            if len(reference) != len(target):
-                changed_values.append(prefix.lstrip('._'))
-            else:
-                for i in range(min(len(reference), len(target))):
-                    self.get_changes(reference[i],
-                                     target[i],
-                                     '%s[%s]' % (prefix, i),
-                                     changed_values)
-        else:
-            # Comparing two values
-            if reference != target:
-                changed_values.append(prefix.lstrip('._'))
+        return get_changed_paths(make_patch(reference, target), reference)
+
+    def reserve_serial_numbers(self, prefix, count=1):
+        """
+        Atomically reserve count consecutive serial numbers for a prepid prefix
+        and return the first one
+        Counters are kept in "counters" collection and are created from the
+        highest existing serial number when prefix is used for the first time
+        """
+        counters_db = Database('counters')
+        counter_id = f'{self.database_name}:{prefix}'
+        last_number = counters_db.increment(counter_id, 'value', count)
+        if last_number is None:
+            database = Database(self.database_name)
+            serial_number = self.get_highest_serial_number(database, prefix)
+            if self.database_name in Database.ARCHIVES:
+                archive = Database(self.database_name, archive=True)
+                serial_number = max(serial_number,
+                                    self.get_highest_serial_number(archive, prefix))
+
+            try:
+                counters_db.save({'_id': counter_id, 'value': serial_number}, 0)
+            except ObjectAlreadyExists:
+                # Counter was created by another request in the meantime
+                pass
+
+            last_number = counters_db.increment(counter_id, 'value', count)
 
-        return changed_values
+        first_number = last_number - count + 1
+        self.logger.debug('Reserved serial numbers %s-%s for %s',
+                          first_number,
+                          last_number,
+                          prefix)
+        return first_number
 
-    def get_highest_serial_number(self, database, query):
+    def get_highest_serial_number(self, database, prefix):
         """
-        Return a sequence number of "highest" _id, including deleted
+        Return a sequence number of "highest" _id with given prefix, including deleted
         """
-        results = database.query(f'_id={query}',
+        results = database.query(Query().starts_with('_id', f'{prefix}-'),
                                  limit=1,
                                  sort_attr='_id',
                                  sort_asc=False,
@@ -279,5 +409,5 @@ class ControllerBase():
         else:
             serial_number = int(results[0]['_id'].split('-')[-1])
 
-        self.logger.debug('Highest serial number for %s is %s', query, serial_number)
+        self.logger.debug('Highest serial number for %s is %s', prefix, serial_number)
         return serial_number
\ No newline at end of file
@@ -5,7 +5,6 @@ import json
 import logging
 import re
 import time
-from copy import deepcopy
 from ..utils.user_info import UserInfo
 from ..utils.common_utils import clean_split
 
@@ -18,11 +17,20 @@ class ModelBase():
     """
     __schema = {}
     __logger = logging.getLogger()
+    # Compiled validation plans of classes, see get_plan
+    __plans = {}
+    # Compiled regular expressions of matches_regex
+    __regexes = {}
     default_lambda_checks = {}
     lambda_checks = {}
 
     def __init__(self, json_input=None, check_attributes=True):
         self.__json = {}
+        # JSON of objects made without checks is shared with the caller
+        # until the first set, see set
+        self.__shared = False
+        # Attributes that are kept as plain JSON until they are accessed
+        self.__lazy = set()
         self.logger = ModelBase.__logger
         self.__class_name = self.__class__.__name__
 
@@ -39,6 +47,7 @@ class ModelBase():
         else:
             self.logger.debug('Using JSON input for %s', self.__class_name)
             self.__json = json_input
+            self.__shared = True
 
         self.initialized = True
 
@@ -47,8 +56,9 @@ class ModelBase():
         Copy values from given dictionary to object's json
         Initialize default values from schema if any are missing
         """
+        plan = self.get_plan()
         if json_input:
-            if 'prepid' in self.__schema or '_id' in self.__schema:
+            if 'prepid' in plan['keys'] or '_id' in plan['keys']:
                 prepid = json_input.get('prepid')
                 if not prepid:
                     raise Exception('PrepID cannot be empty')
@@ -56,27 +66,33 @@ class ModelBase():
                 self.set('prepid', prepid)
 
         ignore_keys = set(['_id', 'prepid'])
-        keys = set(self.__schema.keys())
         if json_input:
             # Just to show errors if any incorrect keys are passed
-            bad_keys = set(json_input.keys()) - keys - ignore_keys
+            bad_keys = set(json_input.keys()) - plan['keys'] - ignore_keys
             if bad_keys:
                 self.logger.warning('Keys that are not in schema of %s: %s',
                                     self.__class_name,
                                     ', '.join(bad_keys))
                 # raise Exception(f'Invalid key "{", ".join(bad_keys)}" for {self.__class_name}')
 
-        self.__fill_values_dict(self.__json, json_input, self.__schema, '', check_attributes)
+        self.__fill_values_dict(self.__json, json_input, plan['fill'], check_attributes)
 
     def __set(self, attribute, target_dict, value, check=True):
-        prepid = self.get_prepid()
         attribute = attribute.strip('.')
-        attribute_in_schema = self.__attribute_in_schema(attribute)
-        if not isinstance(value, type(attribute_in_schema)):
+        _, expected_type, has_check = self.__attribute_info(attribute)
+        self.__set_value(target_dict,
+                         attribute.split('.')[-1],
+                         attribute,
+                         value,
+                         expected_type,
+                         check and has_check)
+
+    def __set_value(self, target_dict, key, attribute, value, expected_type, check):
+        if not isinstance(value, expected_type):
             self.logger.debug('%s of %s is not expected (%s) type (got %s). Will try to cast',
                               attribute,
-                              prepid,
-                              type(attribute_in_schema),
+                              self.get_prepid(),
+                              expected_type,
                               type(value))
             value = self.cast_value_to_correct_type(attribute, value)
 
@@ -84,6 +100,7 @@ class ModelBase():
             value = value.strip()
 
         if check and not self.check_attribute(attribute, value):
+            prepid = self.get_prepid()
             self.logger.error('Invalid value "%s" for key "%s" for object %s of type %s',
                               value,
                               attribute,
@@ -91,31 +108,70 @@ class ModelBase():
                               self.__class_name)
             raise Exception(f'Invalid {attribute} value {value} for {prepid}')
 
-        target_dict[attribute.split('.')[-1]] = value
+        target_dict[key] = value
 
-    def __fill_values_dict(self, target_dict, source_dict, schema_dict, attribute_prefix, check):
-        attribute_prefix = attribute_prefix.strip('.')
-
-        for key, default_value in schema_dict.items():
-            if key == '_id':
-                continue
-
-            # Default value here is another dict from schema
-            # It will be used not as value, but as new schema
-            if isinstance(default_value, dict) and default_value:
+    def __fill_values_dict(self, target_dict, source_dict, plan, check):
+        for key, attribute, default_value, expected_type, has_check, nested_plan in plan:
+            # Default value of nested plan is another dict from schema
+            # It is used not as value, but as new schema
+            if nested_plan is not None:
                 target_dict[key] = {}
                 self.__fill_values_dict(target_dict[key],
                                         source_dict.get(key, {}),
-                                        default_value,
-                                        f'{attribute_prefix}.{key}',
+                                        nested_plan,
                                         check)
             elif key not in source_dict:
-                target_dict[key] = default_value
+                target_dict[key] = ModelBase.copy_json(default_value)
             else:
-                self.__set(f'{attribute_prefix}.{key}',
-                           target_dict,
-                           source_dict[key],
-                           check)
+                self.__set_value(target_dict,
+                                 key,
+                                 attribute,
+                                 source_dict[key],
+                                 expected_type,
+                                 check and has_check)
+
+    @classmethod
+    def get_plan(cls):
+        """
+        Return validation plan of the class that is compiled from schema and
+        lambda checks on first use and then cached
+        Plan has top level keys of schema, list of attributes to fill in schema
+        order and default value, type and whether there are lambda checks of
+        every attribute by its full name
+        """
+        plan = ModelBase.__plans.get(cls)
+        if plan is None:
+            attributes = {}
+            fill = cls.__compile_plan(cls.__schema, '', attributes)
+            plan = {'keys': set(cls.__schema.keys()),
+                    'fill': fill,
+                    'attributes': attributes}
+            ModelBase.__plans[cls] = plan
+
+        return plan
+
+    @classmethod
+    def __compile_plan(cls, schema, attribute_prefix, attributes):
+        """
+        Return list of (key, full name, default value, type, has checks, nested plan)
+        of schema attributes and add their information to attributes dictionary
+        """
+        plan = []
+        for key, default_value in schema.items():
+            attribute = f'{attribute_prefix}.{key}'.strip('.')
+            check_names = (attribute, f'_{attribute}', f'__{attribute}', f'___{attribute}')
+            has_check = any(name in cls.lambda_checks for name in check_names)
+            attributes[attribute] = (default_value, type(default_value), has_check)
+            if key == '_id':
+                continue
+
+            nested_plan = None
+            if isinstance(default_value, dict) and default_value:
+                nested_plan = cls.__compile_plan(default_value, attribute, attributes)
+
+            plan.append((key, attribute, default_value, type(default_value), has_check, nested_plan))
+
+        return plan
 
     def set(self, attribute, value=None):
         """
@@ -125,13 +181,35 @@ class ModelBase():
             raise Exception('Attribute name not specified')
 
         attribute = attribute.strip('.')
+        if self.__shared:
+            # Copy on write, so dictionary the object was made of is not changed
+            self.__json = dict(self.__json)
+            self.__shared = False
+
         self.__set(attribute, self.__json, value)
+        self.__lazy.discard(attribute)
         if attribute == 'prepid':
             self.__json['_id'] = value
 
         return self.__json
 
+    def __attribute_info(self, attribute_name):
+        """
+        Return default value, type and whether there are lambda checks of an attribute
+        """
+        info = self.get_plan()['attributes'].get(attribute_name)
+        if info is None:
+            # Not a plain full name, e.g. with spaces, resolve it the slow way
+            schema = self.__attribute_in_schema(attribute_name)
+            info = (schema, type(schema), True)
+
+        return info
+
     def __attribute_in_schema(self, attribute_name):
+        info = self.get_plan()['attributes'].get(attribute_name)
+        if info is not None:
+            return info[0]
+
         schema = self.__schema
         attribute_path = clean_split(attribute_name, '.')
         for attribute in attribute_path:
@@ -151,9 +229,30 @@ class ModelBase():
             raise Exception('Attribute name not specified')
 
         self.__attribute_in_schema(attribute)
+        if attribute in self.__lazy:
+            self.__lazy.discard(attribute)
+            if self.__shared:
+                self.__json = dict(self.__json)
+                self.__shared = False
+
+            self.__json[attribute] = self.hydrate(attribute, self.__json[attribute])
 
         return self.__json[attribute]
 
+    def set_lazy(self, attribute):
+        """
+        Keep plain JSON value of an attribute until it is accessed with get,
+        then replace it with value returned by hydrate
+        get_json and get_json_view return plain JSON of attributes that were not accessed
+        """
+        self.__lazy.add(attribute)
+
+    def hydrate(self, attribute, value):
+        """
+        Return value of a lazy attribute made from its plain JSON, see set_lazy
+        """
+        return value
+
     def get_prepid(self):
         """
         Return prepid or _id if any of it exist
@@ -242,7 +341,11 @@ class ModelBase():
         """
         Check if given string fully matches given regex
         """
-        matcher = re.compile(regex)
+        matcher = ModelBase.__regexes.get(regex)
+        if matcher is None:
+            matcher = re.compile(regex)
+            ModelBase.__regexes[regex] = matcher
+
         match = matcher.fullmatch(value)
         if match:
             return True
@@ -273,14 +376,59 @@ class ModelBase():
         for attribute, value in self.__json.items():
             built_json[attribute] = self.__get_json(value)
 
-        return deepcopy(built_json)
+        return ModelBase.copy_json(built_json)
+
+    def get_json_view(self):
+        """
+        Return JSON of the object for reading and serializing without copying it
+        Values are shared with the object, so the JSON must not be changed,
+        use get_json to get a JSON that can be changed
+        Only attributes that hold objects, e.g. steps, are built as new lists
+        """
+        view = None
+        for attribute, value in self.__json.items():
+            if isinstance(value, ModelBase):
+                value = value.get_json_view()
+            elif isinstance(value, list) and any(isinstance(item, ModelBase) for item in value):
+                value = [item.get_json_view() if isinstance(item, ModelBase) else item
+                         for item in value]
+            else:
+                continue
+
+            if view is None:
+                view = dict(self.__json)
+
+            view[attribute] = value
+
+        return self.__json if view is None else view
 
     @classmethod
     def schema(cls):
         """
         Return a copy of scema
         """
-        return deepcopy(cls.__schema)
+        return ModelBase.copy_json(cls.__schema)
+
+    @classmethod
+    def get_default(cls, attribute):
+        """
+        Return a copy of default value of a top level attribute from schema
+        """
+        return ModelBase.copy_json(cls.__schema[attribute])
+
+    @staticmethod
+    def copy_json(value):
+        """
+        Return a deep copy of JSON-like value made of dictionaries, lists and
+        immutable values, it is much faster than deepcopy
+        """
+        if isinstance(value, dict):
+            return {key: ModelBase.copy_json(item) for key, item in value.items()}
+
+        if isinstance(value, list):
+            return [ModelBase.copy_json(item) for item in value]
+
+        return value
 
     def __str__(self):
         """
@@ -302,11 +450,11 @@ class ModelBase():
         if user is None:
             user = UserInfo().get_username()
 
-        history = self.get('history')
-        history.append({'action': action,
-                        'time': int(timestamp if timestamp else time.time()),
-                        'user': user,
-                        'value': value})
+        # History list might be shared with the JSON the object was made of
+        history = self.get('history') + [{'action': action,
+                                          'time': int(timestamp if timestamp else time.time()),
+                                          'user': user,
+                                          'value': value}]
         self.set('history', history)
 
     @classmethod
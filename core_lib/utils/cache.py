@@ -3,6 +3,8 @@ Module that contains caching classes
 """
 
 import time
+from collections import OrderedDict
+from threading import RLock
 
 
 class TimeoutCache():
@@ -34,4 +36,97 @@ class TimeoutCache():
             self.values.pop(key)
             return default
 
-        return value['value']
\ No newline at end of file
+        return value['value']
+
+class LRUCache():
+    """
+    Thread-safe cache that keeps up to size most recently used values for
+    timeout seconds and counts hits, misses and evictions
+    """
+    def __init__(self, size=1000, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self.values = OrderedDict()
+        self.lock = RLock()
+        # Generation is increased on every invalidation, so values that were
+        # read before an invalidation are not added to the cache afterwards
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_generation(self):
+        """
+        Return current generation to be passed to set
+        """
+        return self.generation
+
+    def set(self, key, value, generation=None):
+        """
+        Add value to cache
+        Value is not added if cache was invalidated since given generation
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.values.pop(key, None)
+            self.values[key] = {'time': time.time(), 'value': value}
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        """
+        Get value from cache
+        Returns default if value does not exist or expired
+        """
+        with self.lock:
+            value = self.values.get(key, None)
+            if value is None:
+                self.misses += 1
+                return default
+
+            if time.time() > value['time'] + self.timeout:
+                self.values.pop(key)
+                self.evictions += 1
+                self.misses += 1
+                return default
+
+            self.values.move_to_end(key)
+            self.hits += 1
+            return value['value']
+
+    def invalidate(self, key):
+        """
+        Remove value from cache
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.values.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all values from cache
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.values.clear()
+
+    def get_stats(self):
+        """
+        Return cache size and counters
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.values),
+                    'max_size': self.size,
+                    'timeout': self.timeout,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
@@ -24,3 +24,15 @@ class ObjectAlreadyExists(Exception):
 
     def __str__(self):
         return self.message
+
+
+class ObjectConflict(Exception):
+    """
+    Exception to be raised when object was changed by someone else while it was being saved
+    """
+    def __init__(self, prepid, database):
+        self.message = f'Object "{prepid}" in database "{database}" was changed by another request'
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
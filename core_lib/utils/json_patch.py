@@ -0,0 +1,198 @@
+"""
+Module that contains functions that make JSON Patches (RFC 6902)
+Patch is a list of operations, e.g.
+[{"op": "replace", "path": "/steps/1/driver/era", "value": "Run3"},
+ {"op": "add", "path": "/steps/2", "value": {...}},
+ {"op": "remove", "path": "/notes"}]
+Paths are JSON Pointers (RFC 6901), list items are addressed by their index
+"""
+from copy import deepcopy
+
+
+# Lists with more pairs of changed items are compared without looking for common items
+MAX_LCS_SIZE = 10000
+
+
+def escape_token(token):
+    """
+    Escape a key to be used in JSON Pointer
+    """
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def unescape_token(token):
+    """
+    Return key of an escaped JSON Pointer token
+    """
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def split_pointer(pointer):
+    """
+    Return list of unescaped tokens of a JSON Pointer
+    """
+    if not pointer:
+        return []
+
+    if not pointer.startswith('/'):
+        raise Exception(f'Invalid JSON Pointer "{pointer}"')
+
+    return [unescape_token(token) for token in pointer[1:].split('/')]
+
+
+def make_patch(source, target):
+    """
+    Return list of operations that change source to target
+    Dictionaries are compared key by key, lists item by item after common
+    beginning and end are skipped, so items that are inserted or removed
+    result in add and remove operations instead of replacement of whole list
+    """
+    patch = []
+    _diff(source, target, '', patch)
+    return patch
+
+
+def _diff(source, target, pointer, patch):
+    if isinstance(source, dict) and isinstance(target, dict):
+        _diff_dicts(source, target, pointer, patch)
+    elif isinstance(source, list) and isinstance(target, list):
+        _diff_lists(source, target, pointer, patch)
+    elif not _equal(source, target):
+        patch.append({'op': 'replace', 'path': pointer, 'value': deepcopy(target)})
+
+
+def _equal(source, target):
+    # Values of different types are different, even if they are equal, e.g. 1 and 1.0
+    return source == target and _same_types(source, target)
+
+
+def _same_types(source, target):
+    if type(source) is not type(target):
+        return False
+
+    if isinstance(source, dict):
+        return all(_same_types(value, target[key]) for key, value in source.items())
+
+    if isinstance(source, list):
+        return all(_same_types(value, target[index]) for index, value in enumerate(source))
+
+    return True
+
+
+def _diff_dicts(source, target, pointer, patch):
+    for key, value in source.items():
+        key_pointer = f'{pointer}/{escape_token(key)}'
+        if key not in target:
+            patch.append({'op': 'remove', 'path': key_pointer})
+        else:
+            _diff(value, target[key], key_pointer, patch)
+
+    for key, value in target.items():
+        if key not in source:
+            patch.append({'op': 'add',
+                          'path': f'{pointer}/{escape_token(key)}',
+                          'value': deepcopy(value)})
+
+
+def _diff_lists(source, target, pointer, patch):
+    # Skip common beginning and end
+    start = 0
+    source_end = len(source)
+    target_end = len(target)
+    while start < source_end and start < target_end and _equal(source[start], target[start]):
+        start += 1
+
+    while (source_end > start and target_end > start
+           and _equal(source[source_end - 1], target[target_end - 1])):
+        source_end -= 1
+        target_end -= 1
+
+    # Items that did not change split the rest to gaps, items of a gap are
+    # compared in the same positions, the rest is removed or added
+    position = start
+    source_index = start
+    target_index = start
+    anchors = _common_items(source, target, start, source_end, target_end)
+    for source_anchor, target_anchor in anchors + [(source_end, target_end)]:
+        source_gap = source_anchor - source_index
+        target_gap = target_anchor - target_index
+        common_gap = min(source_gap, target_gap)
+        for offset in range(common_gap):
+            _diff(source[source_index + offset],
+                  target[target_index + offset],
+                  f'{pointer}/{position + offset}',
+                  patch)
+
+        # Removed from the end, so indices of items that are not removed yet stay valid
+        for offset in reversed(range(common_gap, source_gap)):
+            patch.append({'op': 'remove', 'path': f'{pointer}/{position + offset}'})
+
+        for offset in range(common_gap, target_gap):
+            patch.append({'op': 'add',
+                          'path': f'{pointer}/{position + offset}',
+                          'value': deepcopy(target[target_index + offset])})
+
+        position += target_gap + 1
+        source_index = source_anchor + 1
+        target_index = target_anchor + 1
+
+
+def _common_items(source, target, start, source_end, target_end):
+    """
+    Return list of (source index, target index) of longest common subsequence
+    of items between start and ends, empty list for long lists
+    """
+    source_length = source_end - start
+    target_length = target_end - start
+    if not source_length or not target_length or source_length * target_length > MAX_LCS_SIZE:
+        return []
+
+    # lengths[i][j] is length of common subsequence of source[i:] and target[j:]
+    lengths = [[0] * (target_length + 1) for _ in range(source_length + 1)]
+    for i in reversed(range(source_length)):
+        for j in reversed(range(target_length)):
+            if _equal(source[start + i], target[start + j]):
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+
+    common = []
+    i = j = 0
+    while i < source_length and j < target_length:
+        if _equal(source[start + i], target[start + j]):
+            common.append((start + i, start + j))
+            i += 1
+            j += 1
+        elif lengths[i + 1][j] >= lengths[i][j + 1]:
+            i += 1
+        else:
+            j += 1
+
+    return common
+
+
+def get_changed_paths(patch, source):
+    """
+    Return list of unique paths changed by the patch in attribute notation,
+    e.g. steps[1].driver.era
+    Source is the document the patch was made from, it is used to tell list
+    indices from dictionary keys
+    """
+    paths = []
+    for operation in patch:
+        path = ''
+        value = source
+        for token in split_pointer(operation['path']):
+            if isinstance(value, list):
+                path += f'[{token}]'
+                index = int(token) if token.isdigit() else len(value)
+                value = value[index] if index < len(value) else None
+            else:
+                path += f'.{token}'
+                value = value.get(token) if isinstance(value, dict) else None
+
+        path = path.lstrip('.')
+        if path not in paths:
+            paths.append(path)
+
+    return paths
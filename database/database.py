@@ -4,9 +4,30 @@ A module that handles all communication with MongoDB
 import logging
 import time
 import json
+import base64
+import hashlib
 import os
 import re
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+from copy import deepcopy
+from threading import RLock, Thread
+from pymongo import (MongoClient,
+                     ASCENDING,
+                     DESCENDING,
+                     TEXT,
+                     ReturnDocument,
+                     UpdateOne,
+                     ReplaceOne,
+                     DeleteOne)
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
+from pymongo.read_preferences import (PrimaryPreferred,
+                                      Secondary,
+                                      SecondaryPreferred,
+                                      Nearest)
+from database.query_advisor import QueryAdvisor
+from database.query_language import Query, QueryParser, render_filter
+from core_lib.utils.exceptions import ObjectAlreadyExists, ObjectConflict
+from core_lib.utils.cache import LRUCache
+from core_lib.utils.json_patch import split_pointer
 
 
 class Database():
@@ -18,33 +39,243 @@ class Database():
     DATABASE_PORT = 27017
     DATABASE_NAME = None
     SEARCH_RENAME = {}
+    INDEXES = {}
+    # Attributes that have lowercase copies for case insensitive search
+    LOWERCASE = {}
+    LOWERCASE_ATTRIBUTE = '_lowercase'
+    # Collections whose history is kept in <collection>_history and
+    # number of latest history entries that are kept in the documents
+    HISTORY = {}
+    # Collections that have <collection>_archive for old documents and tombstones
+    ARCHIVES = set()
+    COUNT_EXACT = 'exact'
+    COUNT_ESTIMATE = 'estimate'
+    COUNT_NONE = 'none'
+    # Estimated count stops counting after this many objects
+    COUNT_CAP = 10000
+    # Shorter words of free text filter are matched using regex
+    MIN_TEXT_WORD = 3
+    # Changes are returned only up to this many seconds ago, so writes that
+    # were stamped with last_update but are not visible yet are not skipped
+    CHANGES_DELAY = 5
+    # Number of documents fetched at once when whole query result is read
+    EXPORT_BATCH_SIZE = 1000
+    SORT_RELEVANCE = 'relevance'
     USERNAME = None
     PASSWORD = None
+    # Read intents: controllers read from primary, listings and dashboards
+    # may read from secondaries if it is configured
+    READ_PRIMARY = 'primary'
+    READ_SEARCH = 'search'
+    # Read preferences of read intents, other intents read from primary
+    READ_PREFERENCES = {}
+    READ_MODES = {'primaryPreferred': PrimaryPreferred,
+                  'secondary': Secondary,
+                  'secondaryPreferred': SecondaryPreferred,
+                  'nearest': Nearest}
+    CLIENT_OPTIONS = {'maxPoolSize': 100,
+                      'maxIdleTimeMS': 300000,
+                      'serverSelectionTimeoutMS': 30000}
+    # MongoClient objects are thread-safe and hold a connection pool,
+    # so one client is shared by all Database objects of a process
+    __clients = {}
+    __clients_pid = os.getpid()
+    __clients_lock = RLock()
+    # Optional cache of documents returned by get
+    __cache = None
+    __cache_watchers = {}
+    # Seconds to wait before restarting a failed change stream
+    CACHE_WATCH_RETRY = 60
 
-    def __init__(self, collection_name=None):
+    def __init__(self, collection_name=None, read_intent=READ_PRIMARY, archive=False):
         """
         Constructor of database interface
+        Read intent selects read preference of the reads, writes always go
+        to primary
+        If archive is True, archive of the collection is used instead
         """
         self.collection_name = collection_name
         self.logger = logging.getLogger()
-        db_host = os.environ.get('DB_HOST', Database.DATABASE_HOST)
-        db_port = int(os.environ.get('DB_PORT', Database.DATABASE_PORT))
         if not Database.DATABASE_NAME:
             raise Exception('Database name is not set')
 
-        if Database.USERNAME and Database.PASSWORD:
-            self.logger.debug('Using DB with username and password. DB: %s', collection_name)
-            self.client = MongoClient(db_host,
-                                      db_port,
-                                      username=Database.USERNAME,
-                                      password=Database.PASSWORD,
-                                      authSource='admin',
-                                      authMechanism='SCRAM-SHA-256')[Database.DATABASE_NAME]
+        self.client = Database.get_client()[Database.DATABASE_NAME]
+        read_preference = Database.READ_PREFERENCES.get(read_intent)
+        # Only documents read from primary are put to cache
+        self.read_primary = read_preference is None
+        if read_preference:
+            self.client = self.client.with_options(read_preference=read_preference)
+
+        if archive:
+            self.collection = self.client[Database.get_archive_collection_name(collection_name)]
         else:
-            self.logger.debug('Using DB without username and password')
-            self.client = MongoClient(db_host, db_port)[Database.DATABASE_NAME]
+            self.collection = self.client[collection_name]
+
+    @staticmethod
+    def get_client():
+        """
+        Return a process-wide MongoClient for current host, port and credentials
+        New client is created only if there is no client for these settings yet
+        """
+        db_host = os.environ.get('DB_HOST', Database.DATABASE_HOST)
+        db_port = int(os.environ.get('DB_PORT', Database.DATABASE_PORT))
+        username = Database.USERNAME
+        password = Database.PASSWORD
+        key = (db_host, db_port, username, password)
+        with Database.__clients_lock:
+            if Database.__clients_pid != os.getpid():
+                # Connection pools must not be shared with a forked process
+                Database.__clients = {}
+                Database.__clients_pid = os.getpid()
+
+            client = Database.__clients.get(key)
+            if client:
+                return client
+
+            logger = logging.getLogger()
+            options = dict(Database.CLIENT_OPTIONS)
+            if username and password:
+                logger.debug('Creating DB client with username and password for %s:%s',
+                             db_host,
+                             db_port)
+                options.update({'username': username,
+                                'password': password,
+                                'authSource': 'admin',
+                                'authMechanism': 'SCRAM-SHA-256'})
+            else:
+                logger.debug('Creating DB client without username and password for %s:%s',
+                             db_host,
+                             db_port)
+
+            client = MongoClient(db_host, db_port, **options)
+            Database.__clients[key] = client
+            return client
+
+    @staticmethod
+    def reset_clients():
+        """
+        Forget all shared clients, for example in a newly forked process
+        Clients are not closed because their sockets belong to the parent process
+        """
+        with Database.__clients_lock:
+            Database.__clients = {}
+            Database.__clients_pid = os.getpid()
+
+    @staticmethod
+    def set_client_options(max_pool_size=None, max_idle_time=None, server_selection_timeout=None):
+        """
+        Set connection pool options of shared clients
+        Idle time and server selection timeout are in seconds
+        Only clients created after this call are affected
+        """
+        if max_pool_size is not None:
+            Database.CLIENT_OPTIONS['maxPoolSize'] = int(max_pool_size)
+
+        if max_idle_time is not None:
+            Database.CLIENT_OPTIONS['maxIdleTimeMS'] = int(max_idle_time) * 1000
+
+        if server_selection_timeout is not None:
+            Database.CLIENT_OPTIONS['serverSelectionTimeoutMS'] = int(server_selection_timeout) * 1000
 
-        self.collection = self.client[collection_name]
+    @staticmethod
+    def set_read_preference(read_intent, mode, max_staleness=None):
+        """
+        Set read preference of a read intent
+        Mode is a MongoDB read preference mode, e.g. secondaryPreferred,
+        primary or empty mode makes intent read from primary
+        Max staleness is in seconds and must be at least 90, empty means no limit
+        """
+        if not mode or mode == 'primary':
+            Database.READ_PREFERENCES.pop(read_intent, None)
+            return
+
+        if mode not in Database.READ_MODES:
+            raise Exception(f'Unknown read preference "{mode}"')
+
+        max_staleness = int(max_staleness) if max_staleness else -1
+        read_preference = Database.READ_MODES[mode](max_staleness=max_staleness)
+        Database.READ_PREFERENCES[read_intent] = read_preference
+
+    @staticmethod
+    def set_cache(size, timeout):
+        """
+        Enable cache of documents returned by get
+        Size is number of documents, timeout is in seconds, size 0 disables cache
+        """
+        Database.__cache = LRUCache(size, timeout) if size else None
+
+    @staticmethod
+    def get_cache_stats():
+        """
+        Return cache counters and status of change stream watchers
+        """
+        if not Database.__cache:
+            return {'enabled': False}
+
+        stats = Database.__cache.get_stats()
+        stats['enabled'] = True
+        stats['watchers'] = dict(Database.__cache_watchers)
+        return stats
+
+    @staticmethod
+    def start_cache_watchers(collection_names):
+        """
+        Start background threads that remove documents changed by other
+        processes from cache
+        Change streams are available only on replica sets, without them cached
+        documents might be up to cache timeout old
+        """
+        if not Database.__cache:
+            return
+
+        for collection_name in collection_names:
+            if collection_name in Database.__cache_watchers:
+                continue
+
+            Database.__cache_watchers[collection_name] = 'starting'
+            thread = Thread(target=Database.watch_changes, args=(collection_name, ), daemon=True)
+            thread.start()
+
+    @staticmethod
+    def watch_changes(collection_name):
+        """
+        Invalidate cached documents of a collection using a change stream
+        """
+        logger = logging.getLogger()
+        pipeline = [{'$project': {'documentKey': 1, 'operationType': 1}}]
+        while True:
+            try:
+                database = Database(collection_name)
+                with database.collection.watch(pipeline) as stream:
+                    Database.__cache_watchers[collection_name] = 'running'
+                    # Changes before the stream was opened are not known
+                    Database.__cache.clear()
+                    for change in stream:
+                        document_key = change.get('documentKey')
+                        if document_key:
+                            database.invalidate(document_key['_id'])
+                        else:
+                            # Collection was dropped or renamed
+                            Database.__cache.clear()
+
+            except PyMongoError as ex:
+                Database.__cache_watchers[collection_name] = f'failed: {ex}'
+                logger.warning('Change stream of %s failed: %s', collection_name, ex)
+
+            time.sleep(Database.CACHE_WATCH_RETRY)
+
+    def get_cache_key(self, document_id):
+        """
+        Return key of a document in cache
+        """
+        return f'{Database.DATABASE_NAME}/{self.collection.name}/{document_id}'
+
+    def invalidate(self, document_id):
+        """
+        Remove a document from cache
+        """
+        if Database.__cache:
+            Database.__cache.invalidate(self.get_cache_key(document_id))
 
     @staticmethod
     def set_host_port(host, port):
@@ -71,6 +302,136 @@ class Database():
 
         Database.SEARCH_RENAME[collection][value] = renamed_value
 
+    @staticmethod
+    def add_lowercase_attribute(collection, attribute):
+        """
+        Keep a lowercase copy of an attribute in _lowercase and index it, so
+        case insensitive equality and prefix searches can use an index
+        """
+        if collection not in Database.LOWERCASE:
+            Database.LOWERCASE[collection] = []
+
+        Database.LOWERCASE[collection].append(attribute)
+        Database.add_index(collection, f'{Database.LOWERCASE_ATTRIBUTE}.{attribute}')
+
+    @staticmethod
+    def add_history_store(collection, summary_size=10):
+        """
+        Keep full history of documents in a separate append-only collection
+        and only summary_size latest entries in the documents themselves
+        """
+        Database.HISTORY[collection] = summary_size
+        Database.add_index(Database.get_history_collection_name(collection),
+                           [('object_id', ASCENDING), ('time', ASCENDING)])
+
+    @staticmethod
+    def get_history_collection_name(collection):
+        """
+        Return name of collection that keeps history of given collection
+        """
+        return f'{collection}_history'
+
+    @staticmethod
+    def add_archive(collection):
+        """
+        Keep old documents and tombstones of a collection in a separate archive
+        collection, archive has the same indexes as the collection
+        """
+        Database.ARCHIVES.add(collection)
+
+    @staticmethod
+    def get_archive_collection_name(collection):
+        """
+        Return name of collection that keeps archived documents of given collection
+        """
+        return f'{collection}_archive'
+
+    @staticmethod
+    def add_index(collection, keys, **options):
+        """
+        Declare an index that must exist in a collection
+        Keys is either an attribute name or a list of (attribute, direction) tuples
+        Options are passed to create_index
+        """
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+
+        if collection not in Database.INDEXES:
+            Database.INDEXES[collection] = []
+
+        Database.INDEXES[collection].append((list(keys), options))
+
+    @staticmethod
+    def get_index_key(keys, weights=None):
+        """
+        Return comparable key of an index from list of (attribute, direction) tuples
+        Text indexes are compared by their attributes (weights)
+        """
+        keys = [(attribute, int(direction) if isinstance(direction, float) else direction)
+                for attribute, direction in keys]
+        if any(direction == TEXT for _, direction in keys):
+            attributes = {attribute for attribute, direction in keys if direction == TEXT}
+            attributes.update(weights or {})
+            attributes.discard('_fts')
+            return (TEXT, ) + tuple(sorted(attributes))
+
+        return tuple(keys)
+
+    @staticmethod
+    def get_text_attributes(collection):
+        """
+        Return list of attributes in the text index of a collection
+        """
+        for keys, _ in Database.INDEXES.get(collection, []):
+            attributes = [attribute for attribute, direction in keys if direction == TEXT]
+            if attributes:
+                return attributes
+
+        return []
+
+    @staticmethod
+    def ensure_indexes():
+        """
+        Create declared indexes that do not exist yet
+        Existing indexes that are not declared are reported, but not dropped,
+        except text indexes, because collection can have only one
+        """
+        logger = logging.getLogger()
+        collection_indexes = list(Database.INDEXES.items())
+        for collection_name, indexes in Database.INDEXES.items():
+            if collection_name in Database.ARCHIVES:
+                archive_name = Database.get_archive_collection_name(collection_name)
+                collection_indexes.append((archive_name, indexes))
+
+        for collection_name, indexes in collection_indexes:
+            try:
+                collection = Database(collection_name).collection
+                existing = {name: Database.get_index_key(info['key'], info.get('weights'))
+                            for name, info in collection.index_information().items()}
+                declared = set()
+                for keys, options in indexes:
+                    index_key = Database.get_index_key(keys, options.get('weights'))
+                    declared.add(index_key)
+                    if index_key in existing.values():
+                        continue
+
+                    if index_key[0] == TEXT:
+                        for name, existing_key in list(existing.items()):
+                            if existing_key[0] == TEXT:
+                                logger.warning('Dropping text index %s in %s', name, collection_name)
+                                collection.drop_index(name)
+                                existing.pop(name)
+
+                    logger.info('Creating index %s in %s', keys, collection_name)
+                    collection.create_index(keys, **options)
+
+                for name, index_key in existing.items():
+                    if index_key not in declared and name != '_id_':
+                        logger.warning('Index %s in %s is not declared', name, collection_name)
+
+            except PyMongoError as ex:
+                logger.error('Could not ensure indexes of %s: %s', collection_name, ex)
+
     @staticmethod
     def set_credentials(username, password):
         """
@@ -95,21 +456,45 @@ class Database():
         """
         return self.collection.count_documents({})
 
-    def get(self, document_id):
+    def get(self, document_id, keep_revision=False):
         """
         Get a single document with given identifier
+        Revision (_rev) is removed unless keep_revision is True
         """
-        result = self.collection.find_one({'_id': document_id})
-        if result and 'last_update' in result:
-            del result['last_update']
+        cache = Database.__cache if self.read_primary else None
+        result = None
+        if cache:
+            cache_key = self.get_cache_key(document_id)
+            result = cache.get(cache_key)
+            if result is not None:
+                # Cached document must not be changed by the caller
+                result = deepcopy(result)
+
+        if result is None:
+            generation = cache.get_generation() if cache else None
+            result = self.collection.find_one({'_id': document_id})
+            if result and cache:
+                cache.set(cache_key, deepcopy(result), generation)
+
+        if result:
+            result.pop('last_update', None)
+            result.pop(Database.LOWERCASE_ATTRIBUTE, None)
+            self.strip_history_markers(result)
+            if not keep_revision:
+                result.pop('_rev', None)
 
         return result
 
     def document_exists(self, document_id):
         """
-        Do a GET request to check whether document exists
+        Check whether document exists without fetching it
         """
-        response = self.get(document_id)
+        response = self.collection.find_one({'_id': document_id}, {'_id': 1})
+        if not response and self.collection_name in Database.ARCHIVES:
+            # Archived identifiers must not be used again
+            archive_name = Database.get_archive_collection_name(self.collection_name)
+            response = self.client[archive_name].find_one({'_id': document_id}, {'_id': 1})
+
         return bool(response)
 
     def delete_document(self, document, purge=False):
@@ -130,15 +515,23 @@ class Database():
             return False
 
         if purge:
-            return self.collection.delete_one({'_id': document_id})
+            try:
+                return self.collection.delete_one({'_id': document_id})
+            finally:
+                self.invalidate(document_id)
 
         deleted_document = {'_id': document_id,
                             'deleted': True}
         return self.save(deleted_document)
 
-    def save(self, document):
+    def save(self, document, revision=None):
         """
-        Save a document
+        Save a document with a single write and increment its revision (_rev)
+        If revision is None, document is saved unconditionally
+        If revision is 0, document must not exist yet, otherwise
+        ObjectAlreadyExists is raised
+        Otherwise document is saved only if it still has the given revision,
+        otherwise ObjectConflict is raised
         """
         if not isinstance(document, dict):
             self.logger.error('%s is not a dictionary', document)
@@ -149,13 +542,565 @@ class Database():
             self.logger.error('%s does not have a _id', document)
             return False
 
+        history_entries = self.pop_new_history(document)
+        try:
+            result = self.__write(document_id, document, revision)
+        finally:
+            self.invalidate(document_id)
+
+        self.store_history(document_id, history_entries)
+        return result
+
+    def save_changes(self, document, revision, patch):
+        """
+        Save only attributes of a document that were changed by the patch with
+        a single write and increment its revision (_rev)
+        Patch is a JSON Patch from the stored document with the given revision
+        to the document, if the stored document does not have the revision
+        anymore, ObjectConflict is raised
+        Whole document is saved if patch cannot be written as an update
+        """
+        if not isinstance(document, dict):
+            self.logger.error('%s is not a dictionary', document)
+            return False
+
+        document_id = document.get('_id', '')
+        if not document_id:
+            self.logger.error('%s does not have a _id', document)
+            return False
+
+        update = self.get_patch_update(document, patch) if revision else None
+        if update is None:
+            return self.save(document, revision)
+
+        history_entries = self.pop_new_history(document)
+        self.prepare_document(document)
+        # Attributes that are maintained by the database are written as a whole
+        for attribute in ('history', 'last_update', Database.LOWERCASE_ATTRIBUTE):
+            if attribute in document:
+                update.setdefault('$set', {})[attribute] = document[attribute]
+            else:
+                update.setdefault('$unset', {})[attribute] = ''
+
+        update['$inc'] = {'_rev': 1}
+        self.logger.debug('Updating %s revision %s: %s', document_id, revision, update)
+        try:
+            result = self.collection.update_one({'_id': document_id, '_rev': revision}, update)
+        finally:
+            self.invalidate(document_id)
+
+        if not result.matched_count:
+            raise ObjectConflict(document_id, self.collection_name)
+
+        self.store_history(document_id, history_entries)
+        return result
+
+    def get_patch_update(self, document, patch):
+        """
+        Return $set and $unset update of attributes changed by the patch or
+        None if the patch cannot be written as an update
+        Lists whose items were added or removed are set as a whole, because
+        items cannot be inserted to or removed from a position with $set
+        Document is the patched document
+        """
+        set_paths = set()
+        unset_paths = set()
+        maintained = {'_id', '_rev', 'history', 'last_update', Database.LOWERCASE_ATTRIBUTE}
+        for operation in patch:
+            tokens = split_pointer(operation['path'])
+            if not tokens:
+                return None
+
+            if tokens[0] in maintained:
+                continue
+
+            # Keys with dots or dollars cannot be used in paths, their parent is set
+            for index, token in enumerate(tokens):
+                if not token or '.' in token or token.startswith('$'):
+                    if index == 0:
+                        return None
+
+                    tokens = tokens[:index]
+                    operation = {'op': 'replace'}
+                    break
+
+            parent = document
+            if len(tokens) > 1:
+                parent = self.get_nested_value(document, '.'.join(tokens[:-1]))
+
+            if isinstance(parent, list) and operation['op'] != 'replace':
+                set_paths.add(tuple(tokens[:-1]))
+            elif operation['op'] == 'remove':
+                unset_paths.add(tuple(tokens))
+            else:
+                set_paths.add(tuple(tokens))
+
+        # Paths inside of other changed paths would conflict with them
+        changed_paths = set_paths | unset_paths
+        update = {}
+        for operator, paths in (('$set', set_paths), ('$unset', unset_paths)):
+            for path in sorted(paths):
+                if any(path[:length] in changed_paths for length in range(1, len(path))):
+                    continue
+
+                attribute = '.'.join(path)
+                value = self.get_nested_value(document, attribute) if operator == '$set' else ''
+                update.setdefault(operator, {})[attribute] = value
+
+        return update
+
+    def pop_new_history(self, document):
+        """
+        Return history entries of a document that are not in history store yet,
+        mark them as stored and keep only latest entries in the document
+        """
+        summary_size = Database.HISTORY.get(self.collection_name)
+        history = document.get('history')
+        if summary_size is None or not isinstance(history, list):
+            return []
+
+        new_entries = [dict(entry) for entry in history if not entry.get('stored')]
+        document['history'] = [dict(entry, stored=True) for entry in history[-summary_size:]]
+        return new_entries
+
+    def strip_history_markers(self, document):
+        """
+        Remove internal stored marks from history entries of a document, so
+        returned history has the same entries as before the history store
+        Entries without the mark are stored again on the next save, storing
+        an entry that is already in history store does not duplicate it
+        """
+        history = document.get('history')
+        if self.collection_name in Database.HISTORY and isinstance(history, list):
+            for entry in history:
+                if isinstance(entry, dict):
+                    entry.pop('stored', None)
+
+        return document
+
+    def store_history(self, document_id, entries):
+        """
+        Insert history entries of a document to history store
+        Entry identifiers are made from their content, so storing same entries
+        again does not duplicate them
+        """
+        self.store_histories({document_id: entries})
+
+    def store_histories(self, histories):
+        """
+        Insert history entries of several documents to history store with a
+        single write, histories is a dictionary of document ids and their entries
+        """
+        history_entries = []
+        for document_id, entries in histories.items():
+            for entry in entries:
+                entry.pop('stored', None)
+                entry_hash = json.dumps([document_id, entry], sort_keys=True, default=str)
+                entry_hash = hashlib.sha1(entry_hash.encode('utf-8')).hexdigest()
+                history_entries.append(dict(entry, _id=entry_hash, object_id=document_id))
+
+        if not history_entries:
+            return
+
+        history_name = Database.get_history_collection_name(self.collection_name)
+        try:
+            self.client[history_name].insert_many(history_entries, ordered=False)
+        except BulkWriteError as ex:
+            errors = [e for e in ex.details.get('writeErrors', []) if e.get('code') != 11000]
+            if errors:
+                self.logger.error('Error storing history of %s: %s',
+                                  ', '.join(histories),
+                                  errors)
+
+    def get_histories(self, document_ids):
+        """
+        Return dictionary of full histories of documents from history store
+        Histories are sorted by time
+        """
+        histories = {document_id: [] for document_id in document_ids}
+        history_name = Database.get_history_collection_name(self.collection_name)
+        entries = self.client[history_name].find({'object_id': {'$in': list(document_ids)}},
+                                                 {'_id': 0})
+        for entry in entries.sort([('object_id', ASCENDING), ('time', ASCENDING)]):
+            histories[entry.pop('object_id')].append(entry)
+
+        return histories
+
+    def join_history(self, documents):
+        """
+        Replace history summaries of documents with their full history
+        Documents without history in the store keep their own history
+        """
+        if self.collection_name not in Database.HISTORY:
+            return documents
+
+        histories = self.get_histories([d['_id'] for d in documents if '_id' in d])
+        for document in documents:
+            if histories.get(document.get('_id')):
+                document['history'] = histories[document['_id']]
+            else:
+                self.strip_history_markers(document)
+
+        return documents
+
+    def copy_history(self, from_document_id, to_document_id):
+        """
+        Copy full history of one document to another document, e.g. after rename
+        """
+        entries = self.get_histories([from_document_id])[from_document_id]
+        self.store_history(to_document_id, entries)
+
+    def move_history_to_store(self, batch_size=500):
+        """
+        Move history entries of all documents in the collection to history store
+        and keep only the latest entries in documents
+        Return number of updated documents
+        """
+        if self.collection_name not in Database.HISTORY:
+            return 0
+
+        updated = 0
+        query_dict = {'history': {'$elemMatch': {'stored': {'$ne': True}}}}
+        for document in self.collection.find(query_dict, {'history': 1}).batch_size(batch_size):
+            history = document['history']
+            new_entries = self.pop_new_history(document)
+            self.store_history(document['_id'], new_entries)
+            # Document is not updated if it was saved in the meantime,
+            # it was stored by the save then
+            result = self.collection.update_one({'_id': document['_id'], 'history': history},
+                                                {'$set': {'history': document['history']},
+                                                 '$inc': {'_rev': 1}})
+            updated += result.modified_count
+            self.invalidate(document['_id'])
+
+        self.logger.info('Moved history of %s documents in %s to history store',
+                         updated,
+                         self.collection_name)
+        return updated
+
+    def insert_many(self, documents):
+        """
+        Insert new documents with a single ordered write, all or nothing
+        If any of the documents already exists, documents that were inserted
+        by this write are removed again and ObjectAlreadyExists is raised
+        """
+        if not documents:
+            return []
+
+        histories = {}
+        for document in documents:
+            histories[document['_id']] = self.pop_new_history(document)
+            self.prepare_document(document)
+            document['_rev'] = 1
+
+        document_ids = [document['_id'] for document in documents]
+        self.logger.debug('Creating %s documents in %s', len(documents), self.collection_name)
+        try:
+            self.collection.insert_many(documents, ordered=True)
+        except BulkWriteError as ex:
+            # Ordered insert stops at the first error, so only the first
+            # nInserted documents were written by this request
+            inserted = document_ids[:ex.details.get('nInserted', 0)]
+            if inserted:
+                self.collection.delete_many({'_id': {'$in': inserted}})
+
+            errors = ex.details.get('writeErrors', [])
+            if errors and errors[0].get('code') == 11000:
+                document_id = document_ids[errors[0].get('index', 0)]
+                raise ObjectAlreadyExists(document_id, self.collection_name) from ex
+
+            raise
+        finally:
+            for document_id in document_ids:
+                self.invalidate(document_id)
+
+        self.store_histories(histories)
+        return document_ids
+
+    def purge_many(self, document_ids):
+        """
+        Remove documents and their stored history from the database, e.g. to
+        roll back documents that were created by insert_many
+        """
+        if not document_ids:
+            return 0
+
+        document_ids = list(document_ids)
+        try:
+            result = self.collection.delete_many({'_id': {'$in': document_ids}})
+        finally:
+            for document_id in document_ids:
+                self.invalidate(document_id)
+
+        if self.collection_name in Database.HISTORY:
+            history_name = Database.get_history_collection_name(self.collection_name)
+            self.client[history_name].delete_many({'object_id': {'$in': document_ids}})
+
+        self.logger.info('Purged %s documents from %s', result.deleted_count, self.collection_name)
+        return result.deleted_count
+
+    def archive(self, query_dict, batch_size=500):
+        """
+        Move documents that match the query to archive collection
+        Documents are copied to the archive first and removed from the collection
+        only if their revision did not change in the meantime, changed documents
+        stay in the collection and their copies are removed from the archive
+        Return number of archived documents
+        """
+        if self.collection_name not in Database.ARCHIVES:
+            raise Exception(f'Collection {self.collection_name} does not have an archive')
+
+        archive_name = Database.get_archive_collection_name(self.collection_name)
+        archive = self.client[archive_name]
+        archived = 0
+        while True:
+            documents = list(self.collection.find(query_dict).limit(batch_size))
+            if not documents:
+                break
+
+            document_ids = [document['_id'] for document in documents]
+            archive.bulk_write([ReplaceOne({'_id': document['_id']}, document, upsert=True)
+                                for document in documents],
+                               ordered=False)
+            try:
+                result = self.collection.bulk_write([DeleteOne({'_id': document['_id'],
+                                                                '_rev': document.get('_rev')})
+                                                     for document in documents],
+                                                    ordered=False)
+            finally:
+                for document_id in document_ids:
+                    self.invalidate(document_id)
+
+            if result.deleted_count < len(documents):
+                changed = self.collection.find({'_id': {'$in': document_ids}}, {'_id': 1})
+                changed = [document['_id'] for document in changed]
+                archive.delete_many({'_id': {'$in': changed}})
+
+            archived += result.deleted_count
+            if not result.deleted_count:
+                # All documents are being changed, try again next time
+                break
+
+        self.logger.info('Archived %s documents of %s', archived, self.collection_name)
+        return archived
+
+    def prepare_document(self, document):
+        """
+        Set last update time and lowercase copies of attributes of a document
+        that is about to be written
+        """
+        document.pop('_rev', None)
         document['last_update'] = int(time.time())
-        if self.document_exists(document_id):
-            self.logger.debug('Updating %s', document_id)
-            return self.collection.replace_one({'_id': document_id}, document)
+        document.pop(Database.LOWERCASE_ATTRIBUTE, None)
+        lowercase = self.get_lowercase_attributes(document)
+        if lowercase:
+            document[Database.LOWERCASE_ATTRIBUTE] = lowercase
+
+    def __write(self, document_id, document, revision):
+        """
+        Write a document to the database, see save
+        """
+        self.prepare_document(document)
+        if revision is None:
+            self.logger.debug('Saving %s', document_id)
+            # Replace the document and increment the stored revision in one write
+            # $literal prevents values starting with $ from being treated as expressions
+            new_revision = {'_rev': {'$add': [{'$ifNull': ['$_rev', 0]}, 1]}}
+            pipeline = [{'$replaceWith': {'$mergeObjects': [{'$literal': document},
+                                                            new_revision]}}]
+            return self.collection.update_one({'_id': document_id}, pipeline, upsert=True)
+
+        document['_rev'] = revision + 1
+        try:
+            if revision == 0:
+                self.logger.debug('Creating %s', document_id)
+                return self.collection.insert_one(document)
+
+            self.logger.debug('Updating %s revision %s', document_id, revision)
+            # If revision changed, upsert fails on duplicate _id
+            return self.collection.replace_one({'_id': document_id, '_rev': revision},
+                                               document,
+                                               upsert=True)
+        except DuplicateKeyError as ex:
+            if revision == 0:
+                raise ObjectAlreadyExists(document_id, self.collection_name) from ex
+
+            raise ObjectConflict(document_id, self.collection_name) from ex
+
+    def get_lowercase_value(self, value):
+        """
+        Return lowercase string or list of lowercase strings, None for other values
+        """
+        if isinstance(value, str):
+            return value.lower()
+
+        if isinstance(value, list):
+            values = []
+            for item in value:
+                item = self.get_lowercase_value(item)
+                if isinstance(item, list):
+                    values.extend(item)
+                elif item is not None:
+                    values.append(item)
+
+            return values
+
+        return None
+
+    def get_lowercase_attributes(self, document):
+        """
+        Return dictionary of lowercase copies of attributes of a document
+        Nested attributes are kept nested, e.g. workflows.name
+        """
+        lowercase = {}
+        for attribute in Database.LOWERCASE.get(self.collection_name, []):
+            value = self.get_lowercase_value(self.get_nested_value(document, attribute))
+            if value is None:
+                continue
+
+            *parents, key = attribute.split('.')
+            target = lowercase
+            for parent in parents:
+                target = target.setdefault(parent, {})
+
+            target[key] = value
+
+        return lowercase
+
+    def update_lowercase_attributes(self, batch_size=500):
+        """
+        Set lowercase copies of attributes of all documents in the collection
+        Return number of updated documents
+        """
+        attributes = Database.LOWERCASE.get(self.collection_name, [])
+        if not attributes:
+            return 0
+
+        projection = {attribute.split('.')[0]: 1 for attribute in attributes}
+        updated = 0
+        updates = {}
+        for document in self.collection.find({}, projection):
+            lowercase = self.get_lowercase_attributes(document)
+            update = {'$set': {Database.LOWERCASE_ATTRIBUTE: lowercase}, '$inc': {'_rev': 1}}
+            updates[document['_id']] = UpdateOne({'_id': document['_id']}, update)
+            if len(updates) >= batch_size:
+                updated += self.write_updates(updates)
+                updates = {}
+
+        if updates:
+            updated += self.write_updates(updates)
+
+        self.logger.info('Updated lowercase attributes of %s documents in %s',
+                         updated,
+                         self.collection_name)
+        return updated
+
+    def write_updates(self, updates):
+        """
+        Write dictionary of document ids and their updates with a single write
+        and remove the documents from cache, return number of updated documents
+        """
+        try:
+            return self.collection.bulk_write(list(updates.values()), ordered=False).modified_count
+        finally:
+            for document_id in updates:
+                self.invalidate(document_id)
+
+    def get_lowercase_changes(self, changes):
+        """
+        Return $set of lowercase copies of changed top level attributes
+        """
+        lowercase = {}
+        for attribute in Database.LOWERCASE.get(self.collection_name, []):
+            if attribute.split('.')[0] not in changes:
+                continue
 
-        self.logger.debug('Creating %s', document_id)
-        return self.collection.insert_one(document)
+            value = self.get_lowercase_value(self.get_nested_value(changes, attribute))
+            if value is not None:
+                lowercase[f'{Database.LOWERCASE_ATTRIBUTE}.{attribute}'] = value
+
+        return lowercase
+
+    def transition(self, document_id, expected_status, status, history_entry, changes=None):
+        """
+        Change status of a document with a single write if it still has the
+        expected status, otherwise raise ObjectConflict
+        Changes are other top level attributes that are set in the same write
+        History entry is appended to the history of the document
+        """
+        changes = dict(changes or {})
+        changes['status'] = status
+        changes['last_update'] = int(time.time())
+        changes.update(self.get_lowercase_changes(changes))
+        summary_size = Database.HISTORY.get(self.collection_name)
+        if summary_size:
+            push = {'$each': [dict(history_entry, stored=True)], '$slice': -summary_size}
+        else:
+            push = {'$each': [history_entry]}
+
+        try:
+            result = self.collection.find_one_and_update({'_id': document_id,
+                                                          'status': expected_status},
+                                                         {'$set': changes,
+                                                          '$inc': {'_rev': 1},
+                                                          '$push': {'history': push}},
+                                                         projection={'_id': 1, '_rev': 1},
+                                                         return_document=ReturnDocument.AFTER)
+        finally:
+            self.invalidate(document_id)
+
+        if not result:
+            raise ObjectConflict(document_id, self.collection_name)
+
+        if summary_size:
+            self.store_history(document_id, [dict(history_entry)])
+
+        return result
+
+    def update_many(self, query_dict, update):
+        """
+        Update all documents that match the query and increment their revisions
+        Update can be an update document or a pipeline
+        Return number of updated documents
+        """
+        try:
+            update = Database.add_revision_increment(update)
+            return self.collection.update_many(query_dict, update).modified_count
+        finally:
+            if Database.__cache:
+                Database.__cache.clear()
+
+    @staticmethod
+    def add_revision_increment(update):
+        """
+        Return a copy of update document or pipeline that also increments
+        revision (_rev), so ETags of changed documents change
+        """
+        if isinstance(update, list):
+            new_revision = {'_rev': {'$add': [{'$ifNull': ['$_rev', 0]}, 1]}}
+            return update + [{'$set': new_revision}]
+
+        update = dict(update)
+        update['$inc'] = dict(update.get('$inc', {}), _rev=1)
+        return update
+
+    def increment(self, document_id, attribute, amount=1):
+        """
+        Atomically increment a number attribute of an existing document
+        Return the new value or None if document does not exist
+        """
+        try:
+            result = self.collection.find_one_and_update({'_id': document_id},
+                                                         {'$inc': {attribute: amount}},
+                                                         projection={attribute: 1},
+                                                         return_document=ReturnDocument.AFTER)
+        finally:
+            self.invalidate(document_id)
+
+        if not result:
+            return None
+
+        return result[attribute]
 
     def query(self,
               query_string=None,
@@ -165,82 +1110,16 @@ class Database():
               ignore_case=False):
         """
         Same as query_with_total_rows, but return only list of objects
+        Objects are not counted
         """
-        return self.query_with_total_rows(query_string,
-                                          page,
-                                          limit,
-                                          sort_attr,
-                                          sort_asc,
-                                          include_deleted,
-                                          ignore_case)[0]
-
-    def get_value_condition(self, value):
-        """
-        Get a condition from value and return value and condition separately
-        """
-        value_condition = None
-        if '<' in value[0]:
-            value_condition = '$lt'
-            value = value[1:]
-        elif value[0] == '>':
-            value_condition = '$gt'
-            value = value[1:]
-        elif value[0] == '!':
-            value_condition = '$ne'
-            value = value[1:]
-
-        self.logger.debug('Value: %s, condition: %s', value, value_condition)
-        return value, value_condition
-
-    def get_value_query(self, key, values, ignore_case=False):
-        """
-        Check for < > and ! in front of values, handle OR operation, use correct attribute type
-        """
-        value_or = []
-        for value in values:
-            value, value_condition = self.get_value_condition(value.strip())
-            if '<int>' in key:
-                value = int(value)
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<int>', ''): value})
-            elif '<float>' in key:
-                value = float(value)
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<float>', ''): value})
-            elif '<bool>' in key:
-                value = bool(value.lower() in ('true', 'yes'))
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<bool>', ''): value})
-            else:
-                if value_condition:
-                    value = {value_condition: value}
-                    value_or.append({key: value})
-                else:
-                    if '*' in value:
-                        if ignore_case:
-                            value = re.compile(f'^{value}$', re.IGNORECASE)
-
-                        value_or.append({key: {'$regex': value}})
-                    else:
-                        if ignore_case:
-                            value = re.compile(f'^{value}$', re.IGNORECASE)
-
-                        value_or.append({key: value})
-
-        self.logger.debug('Key: %s, values: %s, query: %s', key, values, value_or)
-        if len(value_or) > 1:
-            return {'$or': value_or}
-
-        if len(value_or) == 1:
-            return value_or[0]
-
-        return None
+        return self.query_page(query_string,
+                               page,
+                               limit,
+                               sort_attr,
+                               sort_asc,
+                               include_deleted,
+                               ignore_case,
+                               count_mode=Database.COUNT_NONE)[0]
 
     def query_with_total_rows(self,
                               query_string=None,
@@ -250,82 +1129,466 @@ class Database():
                               ignore_case=False,
                               wild_filter=False):
         """
-        Perform a query in a database
+        Perform a query in a database and return list of objects and total number of them
         And operator is &&
         Example prepid=*19*&&is_root=false
-        This is horrible, please think of something better
+        """
+        results, total_rows, _ = self.query_page(query_string,
+                                                 page,
+                                                 limit,
+                                                 sort_attr,
+                                                 sort_asc,
+                                                 include_deleted,
+                                                 ignore_case,
+                                                 wild_filter)
+        return results, total_rows
+
+    def build_query_dict(self,
+                         query_string=None,
+                         include_deleted=False,
+                         ignore_case=False,
+                         wild_filter=False):
+        """
+        Build a MongoDB query dictionary from a query string or a Query
+        Return None if query cannot match anything
         """
         query_dict = {'$and': []}
         if not include_deleted:
             query_dict['$and'].append({'deleted': {'$ne': True}})
 
         if query_string:
-            query_string_parts = [x for x in query_string.split('&&') if x.strip()]
-            self.logger.debug('Query parts %s', query_string_parts)
-            for part in query_string_parts:
-                split_part = part.split('=')
-                key = split_part[0].strip()
-                if key == 'deleted':
-                    # Prevent cheating
-                    continue
-
-                values = split_part[1].strip().replace('**', '*').replace('*', '.*')
-                values = [value.strip() for value in values.split(',') if value.strip()]
-                if not values:
-                    # If no value is given, then no results will be returned
-                    # For example "prepid=" shou return nothing
-                    return [], 0
+            conditions = self.compile_query(query_string, ignore_case)
+            if conditions is None:
+                return None
 
-                value_query = self.get_value_query(key, values, ignore_case)
-                if value_query:
-                    query_dict['$and'].append(value_query)
+            query_dict['$and'].extend(conditions)
 
         if wild_filter:
-            # Create a list of queries that match the regex against each field
-            query = rf".*{wild_filter}.*"
-            queries = []
-            for field_name in self.collection.find_one().keys():
-                queries.append({field_name: {"$regex": re.compile(str(query))}})
-
-            query = {"$or": queries}
-            self.collection.create_index([("$**", TEXT)])
-            query_dict['$and'].append(query)
+            query_dict['$and'].extend(self.get_text_query(wild_filter))
 
         if len(query_dict['$and']) == 1:
             query_dict = query_dict['$and'][0]
         elif not query_dict['$and']:
             query_dict = {}
 
+        return query_dict
+
+    def compile_query(self, query, ignore_case=False):
+        """
+        Return list of MongoDB conditions of a query string or a Query
+        Return None if query cannot match anything
+        """
+        if isinstance(query, Query):
+            return query.compile_conditions()
+
+        lowercase = {attribute: f'{Database.LOWERCASE_ATTRIBUTE}.{attribute}'
+                     for attribute in Database.LOWERCASE.get(self.collection_name, [])}
+        return QueryParser().compile(self.collection_name, query, ignore_case, lowercase)
+
+    def split_text_filter(self, text_filter):
+        """
+        Split free text filter to words that are searched using text index
+        and words that are too short or have wildcards and are matched with regex
+        """
+        text_words = []
+        regex_words = []
+        for word in str(text_filter).split():
+            if len(word) >= Database.MIN_TEXT_WORD and '*' not in word:
+                text_words.append(word)
+            else:
+                regex_words.append(word)
+
+        return text_words, regex_words
+
+    def get_text_query(self, text_filter):
+        """
+        Return list of conditions that all must match for free text filter
+        Each word must be found in one of the text index attributes
+        """
+        attributes = self.get_text_attributes(self.collection_name)
+        text_words, regex_words = self.split_text_filter(text_filter)
+        if not attributes:
+            # No text index, match all words against attributes of any object
+            attributes = list((self.collection.find_one() or {}).keys())
+            regex_words = text_words + regex_words
+            text_words = []
+
+        conditions = []
+        if text_words:
+            # Quoted words are phrases and all phrases must match
+            search = ' '.join('"%s"' % (word.replace('"', '')) for word in text_words)
+            conditions.append({'$text': {'$search': search}})
+
+        for word in regex_words:
+            regex = re.compile(re.escape(word).replace(r'\*', '.*'), re.IGNORECASE)
+            conditions.append({'$or': [{attribute: regex} for attribute in attributes]})
+
+        return conditions
+
+    def get_matched_attributes(self, document, text_filter):
+        """
+        Return list of text index attributes of a document that contain any word of
+        free text filter
+        """
+        matchers = []
+        for word in str(text_filter).split():
+            matchers.append(re.compile(re.escape(word).replace(r'\*', '.*'), re.IGNORECASE))
+
+        matched = []
+        for attribute in self.get_text_attributes(self.collection_name):
+            values = self.get_nested_value(document, attribute)
+            if not isinstance(values, list):
+                values = [values]
+
+            values = [v for v in values if isinstance(v, str)]
+            if any(m.search(v) for m in matchers for v in values):
+                matched.append(attribute)
+
+        return matched
+
+    @staticmethod
+    def is_text_query(query_dict):
+        """
+        Return whether query uses text index
+        """
+        return '$text' in query_dict or any('$text' in q for q in query_dict.get('$and', []))
+
+    def get_sort_attribute(self, sort_attr):
+        """
+        Return attribute name that should be used for sorting in the database
+        """
         if not sort_attr:
             sort_attr = '_id'
         elif sort_attr in Database.SEARCH_RENAME.get(self.collection_name, {}):
             sort_attr = Database.SEARCH_RENAME[self.collection_name][sort_attr]
 
-        sort_attr = sort_attr.replace('<int>', '').replace('<float>', '').replace('<bool>', '')
+        return sort_attr.replace('<int>', '').replace('<float>', '').replace('<bool>', '')
+
+    @staticmethod
+    def get_nested_value(document, attribute):
+        """
+        Get a value from a document using dot notation, e.g. history.0.time
+        Going through a list without an index returns list of values
+        """
+        value = document
+        for key in attribute.split('.'):
+            if isinstance(value, list):
+                if key.isdigit():
+                    index = int(key)
+                    value = value[index] if index < len(value) else None
+                else:
+                    value = [item.get(key) for item in value if isinstance(item, dict)]
+            elif isinstance(value, dict):
+                value = value.get(key)
+            else:
+                return None
+
+        return value
+
+    def count(self, query_dict, count_mode=COUNT_EXACT):
+        """
+        Count objects that match the query
+        Estimated count is exact only up to COUNT_CAP objects
+        """
+        if count_mode == Database.COUNT_NONE:
+            return None
+
+        if count_mode == Database.COUNT_ESTIMATE:
+            if not query_dict:
+                return self.collection.estimated_document_count()
+
+            return self.collection.count_documents(query_dict, limit=Database.COUNT_CAP)
+
+        return self.collection.count_documents(query_dict)
+
+    def make_continuation(self, document, sort_attr, sort_asc):
+        """
+        Make an opaque continuation token that points after the given document
+        Return None if document cannot be used for continuation
+        """
+        value = self.get_nested_value(document, sort_attr)
+        if isinstance(value, (list, dict)):
+            # Array values are sorted by their smallest or largest item
+            # so there is no single position to continue from
+            return None
+
+        token = {'attr': sort_attr,
+                 'asc': sort_asc,
+                 'value': value,
+                 'id': document['_id']}
+        token = json.dumps(token, sort_keys=True).encode('utf-8')
+        return base64.urlsafe_b64encode(token).decode('utf-8')
+
+    def get_continuation_query(self, continuation, sort_attr, sort_asc):
+        """
+        Make a query that matches objects after the position in continuation token
+        Objects are ordered by the sort attribute and then by _id
+        """
+        try:
+            token = base64.urlsafe_b64decode(continuation.encode('utf-8'))
+            token = json.loads(token)
+            last_value = token['value']
+            last_id = token['id']
+            token_attr = token['attr']
+            token_asc = token['asc']
+        except (ValueError, TypeError, KeyError) as ex:
+            raise Exception(f'Invalid continuation token "{continuation}"') from ex
+
+        if token_attr != sort_attr or token_asc != sort_asc:
+            raise Exception('Continuation token was made for a different sorting')
+
+        id_condition = {'$gt' if sort_asc else '$lt': last_id}
+        if sort_attr == '_id':
+            return {'_id': id_condition}
+
+        # Missing and null values come before all other values
+        if last_value is None:
+            after = [{sort_attr: None, '_id': id_condition}]
+            if sort_asc:
+                after.append({sort_attr: {'$ne': None}})
+
+            return {'$or': after}
+
+        after = [{sort_attr: {'$gt' if sort_asc else '$lt': last_value}},
+                 {sort_attr: last_value, '_id': id_condition}]
+        if not sort_asc:
+            after.append({sort_attr: None})
+
+        return {'$or': after}
+
+    def get_projection(self, projection, sort_attr):
+        """
+        Return projection that keeps the sort attribute and whether sort
+        attribute will be in the results
+        Lowercase copies of attributes are always excluded
+        """
+        if not projection:
+            if self.collection_name in Database.LOWERCASE:
+                return {Database.LOWERCASE_ATTRIBUTE: 0}, True
+
+            return None, True
+
+        projection = dict(projection)
+        if any(projection.get(key) for key in projection if key != '_id'):
+            # Inclusion projection, array indices cannot be projected, e.g.
+            # history.0.time must include whole history
+            path = []
+            for key in sort_attr.split('.'):
+                if key.isdigit():
+                    break
+
+                path.append(key)
+
+            projection['.'.join(path)] = 1
+            # Revision tells whether object changed
+            projection['_rev'] = 1
+            return projection, True
+
+        if self.collection_name in Database.LOWERCASE:
+            projection[Database.LOWERCASE_ATTRIBUTE] = 0
+
+        excluded = [key for key, value in projection.items() if not value]
+        sort_attr_included = not any(sort_attr == key or sort_attr.startswith(f'{key}.')
+                                     for key in excluded)
+        return projection, sort_attr_included
+
+    def get_sort(self, query_dict, sort_attr, sort_asc):
+        """
+        Return sort attribute, MongoDB sort list and text score meta projection
+        that is not None if results are sorted by relevance
+        """
+        text_score = None
+        if sort_attr == Database.SORT_RELEVANCE:
+            if self.is_text_query(query_dict):
+                text_score = {'$meta': 'textScore'}
+            else:
+                sort_attr = None
+
+        sort_attr = self.get_sort_attribute(sort_attr)
+        direction = ASCENDING if sort_asc else DESCENDING
+        sort = [(sort_attr, direction)]
+        if text_score:
+            # Most relevant first, relevance cannot be continued from a token
+            sort = [('_score', text_score), ('_id', ASCENDING)]
+        elif sort_attr != '_id':
+            # _id makes order stable for objects with equal values
+            sort.append(('_id', direction))
+
+        return sort_attr, sort, text_score
+
+    def query_page(self,
+                   query_string=None,
+                   page=0, limit=20,
+                   sort_attr=None, sort_asc=True,
+                   include_deleted=False,
+                   ignore_case=False,
+                   wild_filter=False,
+                   continuation=None,
+                   count_mode=COUNT_EXACT,
+                   projection=None):
+        """
+        Perform a query in a database
+        Return list of objects, total number of objects and a continuation token
+        If continuation token is given, page is ignored and results are returned
+        from the position where previous page ended
+        Count mode can be exact, estimate or none (total will be None)
+        Projection is a MongoDB projection dictionary, sort attribute is
+        always included in the results
+        """
+        query_dict = self.build_query_dict(query_string, include_deleted, ignore_case, wild_filter)
+        if query_dict is None:
+            return [], 0, None
+
+        sort_attr, sort, text_score = self.get_sort(query_dict, sort_attr, sort_asc)
         self.logger.debug('Database "%s" query dict %s', self.collection_name, query_dict)
         self.logger.debug('Sorting on %s ascending %s', sort_attr, 'YES' if sort_asc else 'NO')
-        result = self.collection.find(query_dict)
-        result = result.sort(sort_attr, ASCENDING if sort_asc else DESCENDING)
-        total_rows = result.count()
-        result = result.skip(page * limit).limit(limit)
-        return list(result), int(total_rows)
+        start_time = time.time()
+        total_rows = self.count(query_dict, count_mode)
+        page_query_dict = query_dict
+        if continuation and not text_score:
+            continuation_query = self.get_continuation_query(continuation, sort_attr, sort_asc)
+            page_query_dict = {'$and': [query_dict, continuation_query]}
+            page = 0
+
+        projection, sort_attr_included = self.get_projection(projection, sort_attr)
+        if text_score:
+            projection = projection or {}
+            projection['_score'] = text_score
+            sort_attr_included = False
+
+        result = self.collection.find(page_query_dict, projection)
+        result = result.sort(sort)
+        result = [self.strip_history_markers(document)
+                  for document in result.skip(page * limit).limit(limit)]
+        QueryAdvisor().record(self.collection, page_query_dict, sort, limit, time.time() - start_time)
+        next_continuation = None
+        if result and len(result) == limit and sort_attr_included:
+            next_continuation = self.make_continuation(result[-1], sort_attr, sort_asc)
+
+        return result, total_rows, next_continuation
+
+    def query_cursor(self,
+                     query_string=None,
+                     sort_attr=None, sort_asc=True,
+                     include_deleted=False,
+                     ignore_case=False,
+                     wild_filter=False,
+                     projection=None,
+                     batch_size=EXPORT_BATCH_SIZE):
+        """
+        Return an iterator over all objects that match the query without loading
+        them into memory, arguments are same as in query_page
+        """
+        query_dict = self.build_query_dict(query_string, include_deleted, ignore_case, wild_filter)
+        if query_dict is None:
+            return iter([])
+
+        sort_attr, sort, text_score = self.get_sort(query_dict, sort_attr, sort_asc)
+        projection, _ = self.get_projection(projection, sort_attr)
+        if text_score:
+            projection = projection or {}
+            projection['_score'] = text_score
+
+        cursor = self.collection.find(query_dict, projection).sort(sort).batch_size(batch_size)
+        return (self.strip_history_markers(document) for document in cursor)
+
+    def explain_query(self,
+                      query_string=None,
+                      page=0, limit=20,
+                      sort_attr=None, sort_asc=True,
+                      include_deleted=False,
+                      ignore_case=False,
+                      wild_filter=False,
+                      continuation=None):
+        """
+        Return MongoDB filter and sort that query_page would use with same
+        arguments and the winning plan of this query
+        """
+        query_dict = self.build_query_dict(query_string, include_deleted, ignore_case, wild_filter)
+        if query_dict is None:
+            return {'filter': None, 'sort': None, 'plan': None}
+
+        sort_attr, sort, text_score = self.get_sort(query_dict, sort_attr, sort_asc)
+        if continuation and not text_score:
+            continuation_query = self.get_continuation_query(continuation, sort_attr, sort_asc)
+            query_dict = {'$and': [query_dict, continuation_query]}
+            page = 0
+
+        cursor = self.collection.find(query_dict).sort(sort).skip(page * limit).limit(limit)
+        explained = cursor.explain()
+        plan = explained.get('queryPlanner', {}).get('winningPlan')
+        stats = explained.get('executionStats', {})
+        return {'filter': render_filter(query_dict),
+                'sort': [[attribute, direction] for attribute, direction in sort],
+                'plan': render_filter(plan),
+                'docs_examined': stats.get('totalDocsExamined'),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'returned': stats.get('nReturned')}
+
+    def get_changes_page(self, since=0, limit=100, continuation=None, projection=None):
+        """
+        Return documents that were saved or deleted after since timestamp
+        Documents are ordered by last_update and _id and deleted documents
+        are returned as {_id, deleted: True}, purged documents are not returned
+        Return list of documents, continuation token if there are more documents
+        and watermark - timestamp up to which all changes were returned, to be
+        used as since in the next request after there are no more pages
+        """
+        if continuation:
+            try:
+                token = json.loads(base64.urlsafe_b64decode(continuation.encode('utf-8')))
+                since = token['since']
+                until = token['until']
+                position = token['position']
+            except (ValueError, TypeError, KeyError) as ex:
+                raise Exception(f'Invalid continuation token "{continuation}"') from ex
+        else:
+            until = int(time.time()) - Database.CHANGES_DELAY
+            position = None
+
+        query_dict = {'last_update': {'$gte': since, '$lt': until}}
+        if position:
+            position_query = self.get_continuation_query(position, 'last_update', True)
+            query_dict = {'$and': [query_dict, position_query]}
+
+        projection, _ = self.get_projection(projection, 'last_update')
+        if projection and any(projection.get(key) for key in projection if key != '_id'):
+            # Deleted documents must be recognizable
+            projection['deleted'] = 1
+
+        sort = [('last_update', ASCENDING), ('_id', ASCENDING)]
+        start_time = time.time()
+        cursor = self.collection.find(query_dict, projection).sort(sort).limit(limit)
+        results = [self.strip_history_markers(document) for document in cursor]
+        QueryAdvisor().record(self.collection, query_dict, sort, limit, time.time() - start_time)
+        next_continuation = None
+        if len(results) == limit:
+            token = {'since': since,
+                     'until': until,
+                     'position': self.make_continuation(results[-1], 'last_update', True)}
+            token = json.dumps(token, sort_keys=True).encode('utf-8')
+            next_continuation = base64.urlsafe_b64encode(token).decode('utf-8')
+
+        return results, next_continuation, until
 
     def build_query_with_types(self, query_string, object_class):
         """
-        This is horrible, please think of something better
+        Add type suffixes to attributes of query string based on the schema of object
+        class and rename attributes using search renames
         """
         schema = object_class.schema()
-        query_string_parts = [x.strip() for x in query_string.split('&&') if x.strip()]
+        renames = Database.SEARCH_RENAME.get(self.collection_name, {})
         typed_arguments = []
-        for part in query_string_parts:
-            split_part = part.split('=')
-            key = split_part[0]
-            value = split_part[1]
-            if key in Database.SEARCH_RENAME.get(self.collection_name, {}):
-                key = Database.SEARCH_RENAME[self.collection_name][key]
+        for key, value in QueryParser().split(query_string):
+            if key in renames:
+                key = renames[key]
             elif isinstance(schema.get(key), (int, float, bool)):
                 key = f'{key}<{type(schema.get(key)).__name__}>'
 
             typed_arguments.append(f'{key}={value}')
 
         return '&&'.join(typed_arguments)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=Database.reset_clients)
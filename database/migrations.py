@@ -0,0 +1,104 @@
+"""
+Module that contains Migrations class
+"""
+import logging
+import os
+import socket
+import time
+from threading import Thread
+from database.database import Database
+from core_lib.utils.exceptions import ObjectAlreadyExists
+
+
+class Migrations():
+    """
+    One-shot data migrations that are run when application starts
+    Each migration is recorded in migrations collection before it is run by
+    the process that managed to create or take over the record, so it runs
+    in one process at a time, even if several processes start at the same time
+    Migrations that are done are not run again, failed migrations are removed
+    from the collection and run again on next start, migrations that are
+    running for longer than TIMEOUT are assumed to be stopped with their
+    process and are taken over by another process
+    """
+
+    # Seconds after which a running migration can be taken over
+    TIMEOUT = 3600
+    __migrations = []
+
+    @staticmethod
+    def add(name, function):
+        """
+        Declare a migration with unique name
+        Function is called without arguments
+        """
+        Migrations.__migrations.append((name, function))
+
+    @staticmethod
+    def start():
+        """
+        Run migrations in a background thread, so application starts without
+        waiting for them
+        """
+        thread = Thread(target=Migrations.run, daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def acquire(migrations_db, name, owner):
+        """
+        Create a running record of a migration or take over a running record
+        that is older than TIMEOUT, return whether migration should be run
+        """
+        now = int(time.time())
+        record = {'_id': name, 'status': 'running', 'started': now, 'owner': owner}
+        try:
+            migrations_db.save(record, 0)
+            return True
+        except ObjectAlreadyExists:
+            pass
+
+        taken = migrations_db.collection.find_one_and_update(
+            {'_id': name, 'status': 'running', 'started': {'$lt': now - Migrations.TIMEOUT}},
+            {'$set': {'started': now, 'owner': owner}, '$inc': {'_rev': 1}})
+        if taken:
+            logging.getLogger().warning('Taking over migration %s from %s started at %s',
+                                        name,
+                                        taken.get('owner'),
+                                        taken.get('started'))
+
+        return bool(taken)
+
+    @staticmethod
+    def run():
+        """
+        Run all declared migrations that were not run yet
+        """
+        logger = logging.getLogger()
+        migrations_db = Database('migrations')
+        owner = f'{socket.gethostname()}:{os.getpid()}'
+        for name, function in Migrations.__migrations:
+            if not Migrations.acquire(migrations_db, name, owner):
+                logger.debug('Migration %s is done or running in another process', name)
+                continue
+
+            logger.info('Running migration %s', name)
+            started = time.time()
+            try:
+                result = function()
+            except Exception as ex:
+                logger.error('Migration %s failed: %s', name, ex)
+                migrations_db.collection.delete_one({'_id': name, 'owner': owner})
+                continue
+
+            finished = int(time.time())
+            done = migrations_db.collection.update_one({'_id': name, 'owner': owner},
+                                                       {'$set': {'status': 'done',
+                                                                 'finished': finished,
+                                                                 'result': result},
+                                                        '$inc': {'_rev': 1}})
+            if not done.matched_count:
+                logger.warning('Migration %s was taken over by another process', name)
+                continue
+
+            logger.info('Migration %s done in %.2fs', name, time.time() - started)
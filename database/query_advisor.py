@@ -0,0 +1,217 @@
+"""
+Module that contains QueryAdvisor class
+"""
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from queue import Queue, Full
+from threading import RLock, Thread
+
+
+class QueryAdvisor():
+    """
+    Query advisor keeps statistics of query shapes that were run by Database
+    Shape is a query with all values replaced by their types, so queries that
+    differ only in values are counted together
+    Slow or new shapes are explained to find collection scans and in-memory sorts
+    Explains are sampled and run by a background thread, so they do not make
+    requests slower
+    """
+
+    # Queries slower than this are explained, in milliseconds
+    SLOW_QUERY_MS = 100
+    # Explain same shape at most once in this many seconds
+    EXPLAIN_INTERVAL = 600
+    # Probability that a query that needs to be explained is explained
+    EXPLAIN_PROBABILITY = 0.1
+    # Number of queries waiting to be explained, others are not explained
+    EXPLAIN_QUEUE_SIZE = 20
+    # Number of different shapes to keep
+    MAX_SHAPES = 250
+    __shapes = OrderedDict()
+    __shapes_lock = RLock()
+    __explain_queue = Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+    __explain_thread = None
+
+    def __init__(self):
+        self.logger = logging.getLogger()
+
+    def get_value_shape(self, value):
+        """
+        Return a copy of query where values are replaced with names of their types
+        """
+        if isinstance(value, dict):
+            return {key: self.get_value_shape(item) for key, item in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            shapes = []
+            for item in value:
+                shape = self.get_value_shape(item)
+                if shape not in shapes:
+                    shapes.append(shape)
+
+            return shapes
+
+        return f'<{type(value).__name__}>'
+
+    def get_shape_key(self, collection_name, query_dict, sort):
+        """
+        Return a string that identifies query shape
+        """
+        query_shape = json.dumps(self.get_value_shape(query_dict), sort_keys=True)
+        sort_shape = ','.join(f'{attribute}:{direction}' for attribute, direction in sort)
+        return f'{collection_name} {query_shape} sort {sort_shape}'
+
+    def get_plan_stages(self, plan):
+        """
+        Return list of stage names and list of index names used in a query plan
+        """
+        stages = []
+        indexes = []
+        if isinstance(plan, dict):
+            if 'stage' in plan:
+                stages.append(plan['stage'])
+
+            if 'indexName' in plan:
+                indexes.append(plan['indexName'])
+
+            plan = list(plan.values())
+
+        if isinstance(plan, list):
+            for item in plan:
+                if isinstance(item, (dict, list)):
+                    item_stages, item_indexes = self.get_plan_stages(item)
+                    stages.extend(item_stages)
+                    indexes.extend(item_indexes)
+
+        return stages, indexes
+
+    def explain(self, collection, query_dict, sort, limit):
+        """
+        Run explain of a query and return a short summary of the winning plan
+        """
+        cursor = collection.find(query_dict)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        if limit:
+            cursor = cursor.limit(limit)
+
+        explained = cursor.explain()
+        winning_plan = explained.get('queryPlanner', {}).get('winningPlan', {})
+        stats = explained.get('executionStats', {})
+        stages, indexes = self.get_plan_stages(winning_plan)
+        return {'collection_scan': 'COLLSCAN' in stages,
+                'in_memory_sort': 'SORT' in stages,
+                'stages': sorted(set(stages)),
+                'indexes': sorted(set(indexes)),
+                'docs_examined': stats.get('totalDocsExamined'),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'returned': stats.get('nReturned'),
+                'explain_time': int(time.time())}
+
+    def record(self, collection, query_dict, sort, limit, duration):
+        """
+        Record a query that was run on a collection and took duration seconds
+        Errors are logged and never passed to the caller
+        """
+        try:
+            self.record_query(collection, query_dict, sort, limit, duration)
+        except Exception as ex:
+            self.logger.error('Error recording query stats: %s', ex)
+
+    def record_query(self, collection, query_dict, sort, limit, duration):
+        """
+        Update statistics of query shape and explain it if needed
+        """
+        duration_ms = duration * 1000
+        key = self.get_shape_key(collection.name, query_dict, sort)
+        with QueryAdvisor.__shapes_lock:
+            shape = QueryAdvisor.__shapes.pop(key, None)
+            if shape is None:
+                shape = {'shape': key,
+                         'collection': collection.name,
+                         'count': 0,
+                         'total_ms': 0,
+                         'max_ms': 0,
+                         'plan': None}
+
+            shape['count'] += 1
+            shape['total_ms'] += duration_ms
+            shape['max_ms'] = max(shape['max_ms'], duration_ms)
+            shape['last_seen'] = int(time.time())
+            QueryAdvisor.__shapes[key] = shape
+            while len(QueryAdvisor.__shapes) > QueryAdvisor.MAX_SHAPES:
+                QueryAdvisor.__shapes.popitem(last=False)
+
+            plan = shape['plan']
+            explain_needed = plan is None or (
+                duration_ms >= QueryAdvisor.SLOW_QUERY_MS
+                and time.time() - plan['explain_time'] > QueryAdvisor.EXPLAIN_INTERVAL)
+            if not explain_needed or random.random() >= QueryAdvisor.EXPLAIN_PROBABILITY:
+                return
+
+            try:
+                queued = (shape, collection, query_dict, sort, limit)
+                QueryAdvisor.__explain_queue.put_nowait(queued)
+            except Full:
+                return
+
+            # Mark as explained so the same shape is not queued again
+            shape['plan'] = {'explain_time': int(time.time())}
+            self.start_explain_thread()
+
+    def start_explain_thread(self):
+        """
+        Start background thread that explains queued queries if it is not running
+        """
+        with QueryAdvisor.__shapes_lock:
+            thread = QueryAdvisor.__explain_thread
+            if thread and thread.is_alive():
+                return
+
+            thread = Thread(target=self.explain_queued, daemon=True)
+            QueryAdvisor.__explain_thread = thread
+            thread.start()
+
+    def explain_queued(self):
+        """
+        Explain queued queries and store their plans in their shapes
+        """
+        while True:
+            shape, collection, query_dict, sort, limit = QueryAdvisor.__explain_queue.get()
+            try:
+                plan = self.explain(collection, query_dict, sort, limit)
+            except Exception as ex:
+                self.logger.error('Error explaining query: %s', ex)
+                continue
+
+            if plan['collection_scan']:
+                self.logger.warning('Query ran as a collection scan: %s', shape['shape'])
+
+            with QueryAdvisor.__shapes_lock:
+                shape['plan'] = plan
+
+    def get_stats(self, slow_only=False):
+        """
+        Return list of recorded query shapes, slowest in total first
+        """
+        with QueryAdvisor.__shapes_lock:
+            shapes = [dict(shape) for shape in QueryAdvisor.__shapes.values()]
+
+        for shape in shapes:
+            shape['average_ms'] = shape['total_ms'] / shape['count']
+
+        if slow_only:
+            shapes = [s for s in shapes if s['max_ms'] >= QueryAdvisor.SLOW_QUERY_MS]
+
+        return sorted(shapes, key=lambda s: s['total_ms'], reverse=True)
+
+    def reset(self):
+        """
+        Forget all recorded query shapes
+        """
+        with QueryAdvisor.__shapes_lock:
+            QueryAdvisor.__shapes.clear()
@@ -0,0 +1,352 @@
+"""
+Module that contains query language parser, compiled filter cache and query builder
+Query string is a list of attribute=values parts joined with &&
+Values are separated with commas and are joined with OR, e.g. status=new,approved
+Value can start with < (less than), > (greater than) or ! (not equal) and
+can contain * wildcards
+Attribute can have <int>, <float> or <bool> suffix to cast values to that type
+"""
+import re
+from copy import deepcopy
+from bson.regex import Regex
+from core_lib.utils.cache import LRUCache
+
+
+class Node():
+    """
+    Base class of filter AST nodes
+    """
+
+    def compile(self, ignore_case=False, lowercase=None):
+        """
+        Return MongoDB filter of this node or None if node cannot match anything
+        Lowercase is a dictionary of attributes and their lowercase copies that
+        are used for case insensitive matching
+        """
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __repr__(self):
+        attributes = ', '.join(f'{key}={value!r}' for key, value in vars(self).items())
+        return f'{type(self).__name__}({attributes})'
+
+
+class MatchNothing(Node):
+    """
+    Node that does not match any object, e.g. attribute without values
+    """
+
+    def compile(self, ignore_case=False, lowercase=None):
+        return None
+
+
+class Comparison(Node):
+    """
+    Comparison of attribute to a value
+    Operator is one of eq, ne, lt, gt, in, prefix or match
+    Match is a value of query string that is matched as a pattern if case
+    is ignored or if it has wildcards, and as an exact value otherwise
+    """
+
+    OPERATORS = {'eq': None, 'ne': '$ne', 'lt': '$lt', 'gt': '$gt', 'in': '$in'}
+    WILDCARD = '.*'
+    REGEX_CHARACTERS = set('.^$*+?{}[]\\|()')
+
+    def __init__(self, attribute, operator, value, wildcard=False):
+        self.attribute = attribute
+        self.operator = operator
+        self.value = value
+        self.wildcard = wildcard
+
+    def compile(self, ignore_case=False, lowercase=None):
+        if self.operator == 'in' and not self.value:
+            return None
+
+        if self.operator == 'prefix':
+            return {self.attribute: re.compile('^' + re.escape(self.value))}
+
+        if self.operator == 'match':
+            if ignore_case:
+                lowercase_attribute = (lowercase or {}).get(self.attribute)
+                if lowercase_attribute:
+                    condition = self.compile_lowercase(lowercase_attribute)
+                    if condition:
+                        return condition
+
+                return {self.attribute: re.compile(f'^{self.value}$', re.IGNORECASE)}
+
+            if self.wildcard:
+                return {self.attribute: {'$regex': self.value}}
+
+            return {self.attribute: self.value}
+
+        mongo_operator = Comparison.OPERATORS[self.operator]
+        if mongo_operator:
+            return {self.attribute: {mongo_operator: self.value}}
+
+        return {self.attribute: self.value}
+
+    def compile_lowercase(self, lowercase_attribute):
+        """
+        Return condition on lowercase copy of attribute for values without
+        wildcards (equality) or with wildcards only at the end (anchored prefix)
+        Return None for other values that must be matched with a regex
+        """
+        value = self.value
+        prefix = False
+        while value.endswith(Comparison.WILDCARD):
+            value = value[:-len(Comparison.WILDCARD)]
+            prefix = True
+
+        if not value or Comparison.REGEX_CHARACTERS.intersection(value):
+            return None
+
+        value = value.lower()
+        if prefix:
+            # Case sensitive anchored regex is an index range scan
+            return {lowercase_attribute: re.compile('^' + re.escape(value))}
+
+        return {lowercase_attribute: value}
+
+
+class AnyOf(Node):
+    """
+    Node that matches if any of the nodes match
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+
+    def compile(self, ignore_case=False, lowercase=None):
+        conditions = [node.compile(ignore_case, lowercase) for node in self.nodes]
+        conditions = [condition for condition in conditions if condition is not None]
+        if not conditions:
+            return None
+
+        if len(conditions) == 1:
+            return conditions[0]
+
+        return {'$or': conditions}
+
+
+class AllOf(Node):
+    """
+    Node that matches if all of the nodes match
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+
+    def compile_conditions(self, ignore_case=False, lowercase=None):
+        """
+        Return list of conditions that all must match or None if any of the
+        nodes cannot match anything
+        """
+        conditions = []
+        for node in self.nodes:
+            condition = node.compile(ignore_case, lowercase)
+            if condition is None:
+                return None
+
+            conditions.append(condition)
+
+        return conditions
+
+    def compile(self, ignore_case=False, lowercase=None):
+        conditions = self.compile_conditions(ignore_case, lowercase)
+        if conditions is None:
+            return None
+
+        if len(conditions) == 1:
+            return conditions[0]
+
+        return {'$and': conditions}
+
+
+class QueryParser():
+    """
+    Parser of query strings
+    Compiled filters are cached by collection, query string and case sensitivity
+    """
+
+    TYPES = {'<int>': int,
+             '<float>': float,
+             '<bool>': lambda value: value.lower() in ('true', 'yes')}
+    CONDITIONS = {'<': 'lt', '>': 'gt', '!': 'ne'}
+    __cache = LRUCache(size=1000, timeout=3600)
+
+    def split(self, query_string):
+        """
+        Split query string to list of (attribute, values) tuples
+        """
+        parts = []
+        for part in query_string.split('&&'):
+            if not part.strip():
+                continue
+
+            attribute, _, values = part.partition('=')
+            parts.append((attribute.strip(), values.strip()))
+
+        return parts
+
+    def parse(self, query_string):
+        """
+        Parse query string to a filter AST
+        """
+        nodes = []
+        for attribute, values in self.split(query_string):
+            if attribute == 'deleted':
+                # Prevent cheating
+                continue
+
+            nodes.append(self.parse_part(attribute, values))
+
+        return AllOf(nodes)
+
+    def parse_part(self, attribute, values):
+        """
+        Parse attribute and comma separated values to a node
+        """
+        values = values.replace('**', '*').replace('*', '.*')
+        values = [value.strip() for value in values.split(',') if value.strip()]
+        if not values:
+            # If no value is given, then no results will be returned
+            # For example "prepid=" should return nothing
+            return MatchNothing()
+
+        value_type = None
+        for type_suffix, type_cast in QueryParser.TYPES.items():
+            if type_suffix in attribute:
+                attribute = attribute.replace(type_suffix, '')
+                value_type = type_cast
+                break
+
+        nodes = []
+        for value in values:
+            operator = QueryParser.CONDITIONS.get(value[0])
+            if operator:
+                value = value[1:]
+
+            if value_type:
+                nodes.append(Comparison(attribute, operator or 'eq', value_type(value)))
+            elif operator:
+                nodes.append(Comparison(attribute, operator, value))
+            else:
+                nodes.append(Comparison(attribute, 'match', value, wildcard='*' in value))
+
+        if len(nodes) == 1:
+            return nodes[0]
+
+        return AnyOf(nodes)
+
+    def compile(self, collection_name, query_string, ignore_case=False, lowercase=None):
+        """
+        Return list of MongoDB conditions for a query string or None if query
+        cannot match anything
+        Lowercase copies of attributes are used only if case is ignored
+        """
+        key = (collection_name, query_string, ignore_case)
+        cached = QueryParser.__cache.get(key)
+        if cached is None:
+            node = self.parse(query_string)
+            cached = (node.compile_conditions(ignore_case, lowercase), )
+            QueryParser.__cache.set(key, cached)
+
+        return deepcopy(cached[0])
+
+    @staticmethod
+    def get_cache_stats():
+        """
+        Return statistics of compiled filter cache
+        """
+        return QueryParser.__cache.get_stats()
+
+
+class Query():
+    """
+    Builder of queries that are used in code instead of query strings
+    Values are compared exactly, without parsing, wildcards or case folding
+    Example: Query().equals('cmssw_release', release).any_of('status', ['new', 'approved'])
+    """
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, node):
+        """
+        Add a node that must match
+        """
+        self.nodes.append(node)
+        return self
+
+    def equals(self, attribute, value):
+        """
+        Attribute must be equal to value
+        """
+        return self.add(Comparison(attribute, 'eq', value))
+
+    def not_equals(self, attribute, value):
+        """
+        Attribute must not be equal to value
+        """
+        return self.add(Comparison(attribute, 'ne', value))
+
+    def less_than(self, attribute, value):
+        """
+        Attribute must be less than value
+        """
+        return self.add(Comparison(attribute, 'lt', value))
+
+    def greater_than(self, attribute, value):
+        """
+        Attribute must be greater than value
+        """
+        return self.add(Comparison(attribute, 'gt', value))
+
+    def any_of(self, attribute, values):
+        """
+        Attribute must be equal to any of the values
+        Empty list of values does not match anything
+        """
+        return self.add(Comparison(attribute, 'in', list(values)))
+
+    def starts_with(self, attribute, prefix):
+        """
+        Attribute must start with prefix
+        """
+        return self.add(Comparison(attribute, 'prefix', prefix))
+
+    def get_node(self):
+        """
+        Return filter AST of the query
+        """
+        return AllOf(self.nodes)
+
+    def compile_conditions(self, ignore_case=False, lowercase=None):
+        """
+        Return list of MongoDB conditions or None if query cannot match anything
+        """
+        return self.get_node().compile_conditions(ignore_case, lowercase)
+
+    def __repr__(self):
+        return f'Query({self.nodes!r})'
+
+
+def render_filter(value):
+    """
+    Return a copy of MongoDB filter that can be dumped to JSON,
+    compiled regular expressions are replaced with $regex and $options
+    """
+    if isinstance(value, dict):
+        return {key: render_filter(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [render_filter(item) for item in value]
+
+    if isinstance(value, (re.Pattern, Regex)):
+        options = 'i' if value.flags & re.IGNORECASE else ''
+        return {'$regex': value.pattern, '$options': options}
+
+    return value
@@ -0,0 +1,131 @@
+"""
+Tests of history summaries and history store of Database
+Run from repository root: python3 -m unittest discover tests
+"""
+import unittest
+from database.database import Database
+
+
+class FakeCursor(list):
+    """
+    List of documents that can be sorted like a pymongo cursor
+    """
+
+    def sort(self, sort):
+        """
+        Sort documents by list of (attribute, direction)
+        """
+        for attribute, direction in reversed(sort):
+            list.sort(self, key=lambda document, a=attribute: document[a], reverse=direction < 0)
+
+        return self
+
+
+class FakeCollection():
+    """
+    Collection with find_one and find that supports $in filter and exclusion projection
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find_one(self, query_dict):
+        """
+        Return copy of document with given _id
+        """
+        for document in self.documents:
+            if document['_id'] == query_dict['_id']:
+                return dict(document, history=[dict(entry) for entry in document['history']])
+
+        return None
+
+    def find(self, query_dict, projection):
+        """
+        Return copies of documents whose attributes are in given lists
+        """
+        results = FakeCursor()
+        for document in self.documents:
+            if all(document.get(key) in value['$in'] for key, value in query_dict.items()):
+                results.append({k: v for k, v in document.items() if k not in projection})
+
+        return results
+
+
+def make_database(documents, history_entries):
+    """
+    Return tickets Database with fake collection and history store, without connection
+    """
+    database = Database.__new__(Database)
+    database.collection_name = 'tickets'
+    database.read_primary = False
+    database.collection = FakeCollection(documents)
+    history_name = Database.get_history_collection_name('tickets')
+    database.client = {history_name: FakeCollection(history_entries)}
+    return database
+
+
+class HistoryTest(unittest.TestCase):
+    """
+    History returned by the database must look same as before history store
+    """
+
+    def setUp(self):
+        self.summary_size = Database.HISTORY.get('tickets')
+        Database.HISTORY['tickets'] = 2
+        self.history = [{'action': 'created', 'time': 1, 'user': 'a', 'value': ''},
+                        {'action': 'update', 'time': 2, 'user': 'b', 'value': 'notes'},
+                        {'action': 'update', 'time': 3, 'user': 'a', 'value': 'batch'}]
+
+    def tearDown(self):
+        if self.summary_size is None:
+            Database.HISTORY.pop('tickets')
+        else:
+            Database.HISTORY['tickets'] = self.summary_size
+
+    def store(self, document):
+        """
+        Return document as it is saved and its entries as they are in history store
+        """
+        document = dict(document, history=[dict(entry) for entry in document['history']])
+        database = make_database([], [])
+        entries = database.pop_new_history(document)
+        history_entries = [dict(entry, _id=str(index), object_id=document['_id'])
+                           for index, entry in enumerate(entries)]
+        return document, history_entries
+
+    def test_full_history(self):
+        """
+        history=full returns all entries in pre-change shape
+        """
+        document, history_entries = self.store({'_id': 'T-1', 'history': self.history})
+        self.assertTrue(all(entry.get('stored') for entry in document['history']))
+        database = make_database([document], history_entries)
+        result = database.join_history([database.get('T-1')])
+        self.assertEqual(result[0]['history'], self.history)
+
+    def test_summary(self):
+        """
+        Stored marks are not returned with history summary
+        """
+        document, _ = self.store({'_id': 'T-1', 'history': self.history})
+        database = make_database([document], [])
+        self.assertEqual(database.get('T-1')['history'], self.history[-2:])
+        result = database.join_history([dict(document)])
+        self.assertEqual(result[0]['history'], self.history[-2:])
+
+    def test_restore(self):
+        """
+        Entries without stored marks are stored again with same content
+        """
+        document, history_entries = self.store({'_id': 'T-1', 'history': self.history})
+        database = make_database([document], history_entries)
+        returned = database.get('T-1')
+        returned['history'].append({'action': 'reset', 'time': 4, 'user': 'b', 'value': ''})
+        _, new_entries = self.store(returned)
+        new_entries = [{k: v for k, v in e.items() if k not in ('_id', 'object_id')}
+                       for e in new_entries]
+        self.assertEqual(new_entries, returned['history'])
+
+
+if __name__ == '__main__':
+    unittest.main()